@@ -8,9 +8,56 @@ Original Author: edc@mindthump.org
 """
 import sys
 import argparse
-from people.people_data import PeopleData
-from people import student, employee, utils
-from people.volunteer import Volunteer
+import atexit
+import importlib
+import itertools
+import json
+import logging
+import os
+import time
+from people.people_data import PeopleData, DEFAULT_PAGE_SIZE
+from people.backends import ENGINES
+from people.latency import LatencyModel
+from people.writers import WRITERS
+from people import utils
+
+# Everything else (asyncio, the process pool, the loader, even the badge
+# classes) is imported where it's used. A short run only pays for what it
+# needs; asyncio alone would add about a third to the startup time.
+
+# Seconds BadgeApp may take to get ready to print when the data comes from a
+# snapshot. Going over it is logged as a warning. benchmarks/bench_startup.py
+# measures the whole process, interpreter and imports included.
+STARTUP_BUDGET = 0.02
+
+# (person type, section header, badge class) for every type we can print, in the
+# default order. `--types` picks and orders a subset of them. The classes are
+# named rather than imported; `load_badge_class()` imports the ones asked for.
+BADGE_SECTIONS = [
+    ("STUDENT", "STUDENTS", "people.student.Student"),
+    ("EMPLOYEE", "EMPLOYEES", "people.employee.Employee"),
+    ("VOLUNTEER", "VOLUNTEERS", "people.volunteer.Volunteer"),
+]
+
+
+def load_badge_class(class_path):
+    """
+    The class named by a dotted path like "people.student.Student".
+    """
+    module_name, _, class_name = class_path.rpartition(".")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def positive_int(value):
+    """
+    An argparse `type` for counts and sizes, which have to be at least 1:
+    no threads, or a page of -1 people (sqlite's `LIMIT -1`, i.e. no limit
+    at all), makes no sense.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return number
 
 
 class BadgeApp(object):
@@ -18,6 +65,7 @@ class BadgeApp(object):
 
     def __init__(self, init_parameters):
         """ """
+        started = time.perf_counter()
         parser = argparse.ArgumentParser(description="Print name badges.")
         parser.add_argument(
             "-v",
@@ -25,32 +73,594 @@ class BadgeApp(object):
             help="Show all log messages on standard error stream",
             action="store_true",
         )
+        parser.add_argument(
+            "--async",
+            dest="use_async",
+            help="Fetch all the sections concurrently with asyncio",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--concurrency",
+            help="Maximum number of queries in flight in --async mode",
+            type=positive_int,
+            default=8,
+        )
+        parser.add_argument(
+            "--workers",
+            help="Render the sections on a pool of N threads",
+            type=positive_int,
+            default=1,
+        )
+        parser.add_argument(
+            "--processes",
+            help="Split the roster by ID range across N worker processes",
+            type=positive_int,
+            default=1,
+        )
+        parser.add_argument(
+            "--database",
+            help="Keep the people in this sqlite file instead of in memory",
+            metavar="PATH",
+        )
+        parser.add_argument(
+            "--types",
+            help="Comma-separated person types to print, in order (default: all)",
+            type=lambda value: value.upper().split(","),
+            default=[person_type for person_type, _, _ in BADGE_SECTIONS],
+        )
+        parser.add_argument(
+            "--load",
+            help="Add people from a CSV or JSONL file (may be repeated)",
+            action="append",
+            default=[],
+            metavar="PATH",
+        )
+        parser.add_argument(
+            "--snapshot",
+            help="Start from this prebuilt database file, building it first if it"
+            " is missing or out of date (any --database file will do too)",
+            metavar="PATH",
+        )
+        parser.add_argument(
+            "--mmap",
+            help="Use the --snapshot file read-only and memory-mapped instead of"
+            " copying it into memory",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--backend",
+            help="Answer lookups from sqlite, or from a copy of the data held in"
+            " another engine (default: sqlite)",
+            choices=["sqlite"] + sorted(ENGINES),
+            default="sqlite",
+        )
+        parser.add_argument(
+            "--format",
+            help="Output format (default: text)",
+            choices=sorted(WRITERS),
+            default="text",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write the badges to this file instead of standard output"
+            " (gzip-compressed if it ends in .gz)",
+            metavar="PATH",
+        )
+        parser.add_argument(
+            "--compress",
+            help="gzip-compress the output",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--latency",
+            help="Simulated cost of each query, e.g. '2', 'none' or"
+            " 'fixed=0.1,per_row=0.001,jitter=exponential:0.05'",
+            type=LatencyModel.from_spec,
+        )
+        parser.add_argument(
+            "--profile",
+            help="Time every query and badge, and print a summary at exit",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--incremental",
+            help="Keep the rendered badges in this file and only re-render the"
+            " people who changed since the last run",
+            metavar="PATH",
+        )
+        parser.add_argument(
+            "--page-size",
+            help="Walk the roster a page of N people at a time, so memory use"
+            " stays bounded however big it is",
+            type=positive_int,
+        )
+        parser.add_argument(
+            "--resume",
+            help="Page through the roster, recording progress in this file; if"
+            " it's there, carry on where the interrupted run stopped (needs an"
+            " uncompressed --output)",
+            metavar="PATH",
+        )
+        parser.add_argument(
+            "--serve",
+            help="Stay up and serve badges over HTTP on this localhost port"
+            " (0 picks a free one); see people/server.py",
+            type=int,
+            metavar="PORT",
+        )
+        parser.add_argument(
+            "--explain",
+            help="Print sqlite's query plans for the basic lookups and exit",
+            action="store_true",
+        )
         self.args = parser.parse_args(init_parameters)
+        # Each of these picks how `run()` produces the badges; it can only
+        # do one of them, and would otherwise quietly ignore the rest.
+        run_modes = {
+            "--incremental": self.args.incremental,
+            "--page-size/--resume": self.args.page_size or self.args.resume,
+            "--async": self.args.use_async,
+            "--workers": self.args.workers > 1,
+            "--processes": self.args.processes > 1,
+            "--serve": self.args.serve is not None,
+            "--explain": self.args.explain,
+        }
+        chosen_modes = [name for name, chosen in run_modes.items() if chosen]
+        if len(chosen_modes) > 1:
+            parser.error(f"{' and '.join(chosen_modes)} can't be used together")
+        if (self.args.serve is not None or self.args.explain) and (
+            self.args.output or self.args.compress or self.args.format != "text"
+        ):
+            # Neither writes any badges out.
+            parser.error(
+                "--output, --compress and --format don't apply to --serve or --explain"
+            )
+        if self.args.snapshot and (self.args.database or self.args.load):
+            # Either would leave the data different from the snapshot's.
+            parser.error("--snapshot can't be combined with --database or --load")
+        if self.args.resume and (
+            not self.args.output
+            or self.args.compress
+            or self.args.output.endswith(".gz")
+        ):
+            parser.error("--resume needs an uncompressed --output file")
+        if self.args.latency is not None:
+            PeopleData.latency = self.args.latency
+        if self.args.profile:
+            metrics = PeopleData.enable_metrics()
+            atexit.register(lambda: print(metrics.summary(), file=sys.stderr))
+        sections_by_type = {section[0]: section for section in BADGE_SECTIONS}
+        unknown_types = set(self.args.types) - set(sections_by_type)
+        if unknown_types:
+            parser.error(f"unknown person types: {', '.join(sorted(unknown_types))}")
+        self.sections = []
+        for person_type in self.args.types:
+            _, header, class_path = sections_by_type[person_type]
+            self.sections.append((person_type, header, load_badge_class(class_path)))
+        if self.args.database:
+            PeopleData.configure_connections(
+                self.args.database, per_thread=self.args.workers > 1
+            )
+        elif self.args.workers > 1:
+            # Threads can't share the default private in-memory database, so
+            # give each one its own connection to a shared-cache copy.
+            PeopleData.configure_connections(
+                "file:badges?mode=memory&cache=shared", per_thread=True
+            )
         self.peopleDatabase = PeopleData()
-        PeopleData.initialize_data()
+        snapshot = self.args.snapshot
+        try:
+            restored = bool(snapshot) and PeopleData.restore_snapshot(
+                snapshot, read_only=self.args.mmap
+            )
+        except PeopleData.connection.DatabaseError as error:
+            # Not ours to overwrite with a fresh snapshot.
+            parser.error(f"--snapshot {snapshot}: {error}")
+        if not restored:
+            # Don't seed the demo people into somebody's own roster (or undo
+            # their changes to IDs 1-8 every run).
+            PeopleData.initialize_data(only_if_empty=bool(self.args.database))
+            if snapshot:
+                PeopleData.save_snapshot(snapshot)
+                if self.args.mmap:
+                    PeopleData.restore_snapshot(snapshot, read_only=True)
+        if self.args.load:
+            from people.loader import load_people
+
+            for path in self.args.load:
+                load_people(path)
+        PeopleData.use_backend(self.args.backend)
+        self.startup_seconds = time.perf_counter() - started
+        logging.debug("Ready in %.1f ms.", self.startup_seconds * 1000)
+        # The budget is for starting from a snapshot; the run that has to
+        # build one first is expected to take longer.
+        if restored and self.startup_seconds > STARTUP_BUDGET:
+            logging.warning(
+                "Startup took %.1f ms, over the %.1f ms budget.",
+                self.startup_seconds * 1000,
+                STARTUP_BUDGET * 1000,
+            )
 
     def run(self):
         """ """
-        students = self.peopleDatabase.get_people_by_type("STUDENT")
-        print("------- STUDENTS -------")
-        for student_ in students:
-            print(student.Student(student_[0]).get_badge_text())
+        if self.args.explain:
+            for query_string, plan in PeopleData.explain_queries().items():
+                print(query_string)
+                for step in plan:
+                    print(f"    {step}")
+            return 0
+        if self.args.serve is not None:
+            return self.serve()
+
+        # Where an interrupted --resume run got to: {"type": the section it
+        # was in, "after_id": the last ID written, "offset": the length of
+        # the output up to there}.
+        self.progress = None
+        if self.args.resume and os.path.exists(self.args.resume):
+            with open(self.args.resume) as progress_file:
+                self.progress = json.load(progress_file)
+            logging.info("Resuming after ID %s.", self.progress["after_id"])
+
+        # Every mode hands its badges to the writer, which buffers them into
+        # a few large writes in the chosen format.
+        self.writer = WRITERS[self.args.format](
+            path=self.args.output,
+            compress=self.args.compress,
+            resume_offset=self.progress and self.progress["offset"],
+        )
+        try:
+            if self.args.incremental:
+                return self.run_incremental()
+            if self.args.page_size or self.args.resume:
+                return self.run_paged()
+            if self.args.use_async:
+                import asyncio
+
+                return asyncio.run(self.run_async())
+            if self.args.workers > 1:
+                return self.run_threaded()
+            if self.args.processes > 1:
+                return self.run_sharded()
+            return self.run_serial()
+        finally:
+            self.writer.close()
+
+    def run_serial(self):
+        """
+        The everyday mode: one query, badges written as the rows arrive.
+        """
+        # One query for every section, grouped by type in section order.
+        # Rows are streamed off the cursor, so badges print as soon as the
+        # first batch arrives. They also hold everything a badge needs, so
+        # each one is rendered straight from its row.
+        people = self.peopleDatabase.iter_people_grouped_by_type(
+            person_type for person_type, _, _ in self.sections
+        )
+        groups = itertools.groupby(people, key=lambda person: person.type)
+        try:
+            group_type, group = next(groups, (None, None))
+        except PeopleData.connection.DataError:
+            # Nobody of any of these types: every section is empty.
+            group_type, group = None, None
+        for person_type, header, badge_class in self.sections:
+            # Print the header even when nobody of that type turned up.
+            self.writer.write_section(person_type, header)
+            if person_type != group_type:
+                continue
+            for person in group:
+                self.writer.write_badge(person, self.render_badge(badge_class, person))
+            group_type, group = next(groups, (None, None))
+
+        return 0
+
+    def serve(self):
+        """
+        Answer badge requests over HTTP until interrupted, all from this
+        one PeopleData, which stays warm between requests.
+        """
+        from people.server import BadgeServer
+
+        if PeopleData.backend is None and PeopleData.cache is None:
+            # Every person looked up once is then free for the next request.
+            PeopleData.enable_cache(max_size=100000)
+        badge_classes = {person_type: cls for person_type, _, cls in self.sections}
+        self.server = BadgeServer(
+            ("127.0.0.1", self.args.serve), badge_classes, self.peopleDatabase
+        )
+        logging.info(
+            "Serving badges on http://127.0.0.1:%d/", self.server.server_address[1]
+        )
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+
+        return 0
 
-        employees = self.peopleDatabase.get_people_by_type("EMPLOYEE")
-        print("------- EMPLOYEES -------")
-        for employee_ in employees:
-            print(employee.Employee(employee_[0]).get_badge_text())
+    def run_paged(self):
+        """
+        Walk each section a page at a time, keyset-paginated (see
+        `PeopleData.get_people_by_type_page()`): only one page is ever in
+        memory, and every page costs the same however far in it is.
 
-        volunteers = self.peopleDatabase.get_people_by_type("VOLUNTEER")
-        print("------- VOLUNTEERS -------")
-        for volunteer_ in volunteers:
-            print(Volunteer().get_badge_text(volunteer_[0], self.peopleDatabase))
+        With --resume, progress is saved after the header and after every
+        page, once that much output is safely in the file. A later run
+        cuts the file back to the last save and carries on from there, so
+        nothing ends up missing or written twice. A finished run removes
+        the progress file.
+        """
+        page_size = self.args.page_size or DEFAULT_PAGE_SIZE
+        progress = self.progress
+        for person_type, header, badge_class in self.sections:
+            if progress is not None:
+                # Skip the sections the interrupted run finished.
+                if person_type != progress["type"]:
+                    continue
+                after_id = progress["after_id"]
+                progress = None
+            else:
+                after_id = None
+                self.writer.write_section(person_type, header)
+                self.save_progress(person_type, after_id)
+            while True:
+                people, token = self.peopleDatabase.get_people_by_type_page(
+                    person_type, after_id, page_size
+                )
+                for person in people:
+                    badge_text = self.render_badge(badge_class, person)
+                    self.writer.write_badge(person, badge_text)
+                if people:
+                    after_id = people[-1].id
+                    self.save_progress(person_type, after_id)
+                if token is None:
+                    break
+        if self.args.resume:
+            os.remove(self.args.resume)
 
         return 0
 
+    def save_progress(self, person_type, after_id):
+        if not self.args.resume:
+            return
+        progress = {
+            "type": person_type,
+            "after_id": after_id,
+            "offset": self.writer.checkpoint(),
+        }
+        temporary_path = f"{self.args.resume}.tmp"
+        with open(temporary_path, "w") as progress_file:
+            json.dump(progress, progress_file)
+        os.replace(temporary_path, self.args.resume)
+
+    def run_incremental(self):
+        """
+        Reuse the badges saved by the last run, re-rendering only the people
+        the database says were inserted, updated or deleted since then. With
+        no usable cache (or one for another database or other types) every
+        badge is rendered, and saved for next time.
+        """
+        from people.badge_cache import BadgeCache
+
+        cache_path = self.args.incremental
+        person_types = [person_type for person_type, _, _ in self.sections]
+        badge_classes = {section[0]: section[2] for section in self.sections}
+        # Take the watermark first: anything that changes while we work gets
+        # picked up again next time.
+        watermark = PeopleData.current_change()
+        database_id = PeopleData.database_id()
+        cache = BadgeCache.load(cache_path)
+        reused = removed = 0
+        if cache is not None and cache.matches(database_id, person_types):
+            changed_ids = []
+            for _id, deleted in PeopleData.changes_since(cache.watermark):
+                if cache.badges.pop(_id, None) is not None:
+                    removed += deleted
+                if not deleted:
+                    changed_ids.append(_id)
+            reused = len(cache.badges)
+            changed_ids = list(dict.fromkeys(changed_ids))
+            try:
+                people = self.peopleDatabase.get_people_by_ids(changed_ids)
+            except PeopleData.connection.DataError:
+                # Everybody who changed has been deleted again since.
+                people = []
+        else:
+            cache = BadgeCache(database_id, person_types)
+            try:
+                people = list(
+                    self.peopleDatabase.iter_people_grouped_by_type(person_types)
+                )
+            except PeopleData.connection.DataError:
+                people = []
+        rendered = 0
+        for person in people:
+            if person.type in badge_classes:
+                badge_text = self.render_badge(badge_classes[person.type], person)
+                cache.badges[person.id] = (person, badge_text)
+                rendered += 1
+            # Otherwise they changed type to one we don't print.
+        cache.watermark = watermark
+        cache.save(cache_path)
+
+        badges_by_type = {person_type: [] for person_type in person_types}
+        for _id in sorted(cache.badges):
+            person, badge_text = cache.badges[_id]
+            badges_by_type[person.type].append((person, badge_text))
+        for person_type, header, _badge_class in self.sections:
+            self.writer.write_section(person_type, header)
+            for person, badge_text in badges_by_type[person_type]:
+                self.writer.write_badge(person, badge_text)
+        logging.info(
+            "%d badges reused, %d re-rendered, %d removed.", reused, rendered, removed
+        )
+
+        return 0
+
+    def render_badge(self, badge_class, person):
+        """
+        Render one badge from its row, timing it when metrics are on.
+        """
+        metrics = PeopleData.metrics
+        if metrics is None:
+            return badge_class.get_badge_text_from_row(person)
+        started = time.perf_counter()
+        badge_text = badge_class.get_badge_text_from_row(person)
+        metrics.record_render(badge_class.__name__, time.perf_counter() - started)
+        return badge_text
+
+    def render_section(self, section):
+        """
+        Fetch one section's people and return (person, badge text) pairs.
+        """
+        person_type, _header, badge_class = section
+        try:
+            people = self.peopleDatabase.get_people_by_type(person_type)
+        except PeopleData.connection.DataError:
+            # Nobody of that type: just the header, as in the other modes.
+            people = []
+        # Render straight from the rows instead of looking each person up again.
+        return [(person, self.render_badge(badge_class, person)) for person in people]
+
+    def run_threaded(self):
+        """
+        Render the sections on a thread pool. `map()` returns the results in
+        the order of the sections, so the output doesn't change.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.args.workers) as pool:
+            for section, badges in zip(
+                self.sections, pool.map(self.render_section, self.sections)
+            ):
+                self.writer.write_section(section[0], section[1])
+                for person, badge_text in badges:
+                    self.writer.write_badge(person, badge_text)
+
+        return 0
+
+    def run_sharded(self):
+        """
+        Split the roster into ID ranges and render each one in its own
+        process. Every worker opens the database file itself and returns
+        its badges by section. Shards are in ID order, so putting the
+        sections back together shard by shard gives the usual output.
+        """
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+
+        # A snapshot file holds exactly the data we have.
+        database = self.args.database or self.args.snapshot
+        snapshot_path = None
+        if not database:
+            # Worker processes can't see our in-memory database; copy it out.
+            snapshot_fd, snapshot_path = tempfile.mkstemp(suffix=".db")
+            os.close(snapshot_fd)
+            PeopleData.save_to_file(snapshot_path)
+            database = snapshot_path
+        person_types = [person_type for person_type, _, _ in self.sections]
+        shards = [
+            (database, person_types, first_id, last_id, PeopleData.latency)
+            for first_id, last_id in PeopleData.shard_id_ranges(self.args.processes)
+        ]
+        try:
+            with ProcessPoolExecutor(max_workers=self.args.processes) as pool:
+                results = list(pool.map(render_shard, shards))
+        finally:
+            if snapshot_path:
+                os.remove(snapshot_path)
+
+        for person_type, header, _badge_class in self.sections:
+            self.writer.write_section(person_type, header)
+            for badges_by_type, _stats in results:
+                for person, badge_text in badges_by_type[person_type]:
+                    self.writer.write_badge(person, badge_text)
+        for shard, (_badges, stats) in zip(shards, results):
+            logging.info(
+                "Worker %d rendered IDs %d-%d: %d badges in %.2fs (%.0f badges/s).",
+                stats["pid"],
+                shard[2],
+                shard[3],
+                stats["badges"],
+                stats["seconds"],
+                stats["badges"] / stats["seconds"] if stats["seconds"] else 0,
+            )
+
+        return 0
+
+    async def run_async(self):
+        """
+        Same output as `run()`, but all the sections are fetched at once, so
+        the whole run takes about as long as the slowest query.
+        """
+        import asyncio
+        from people.async_people_data import AsyncPeopleData
+
+        async_database = AsyncPeopleData(
+            self.peopleDatabase, max_concurrency=self.args.concurrency
+        )
+
+        async def get_section(person_type):
+            try:
+                return await async_database.get_people_by_type(person_type)
+            except PeopleData.connection.DataError:
+                # Nobody of that type: just the header, as in the other modes.
+                return []
+
+        # `gather()` hands back the results in the order we asked for them,
+        # however the queries happen to finish.
+        sections = await asyncio.gather(
+            *(
+                get_section(person_type)
+                for person_type, _header, _badge_class in self.sections
+            )
+        )
+        for (person_type, header, badge_class), people in zip(self.sections, sections):
+            self.writer.write_section(person_type, header)
+            for person in people:
+                self.writer.write_badge(person, self.render_badge(badge_class, person))
+
+        return 0
+
+
+def render_shard(shard):
+    """
+    Runs in a worker process for `BadgeApp.run_sharded()`: render everyone
+    in one ID range, returning ({person type: [(person, badge text)]}, stats).
+    """
+    database, person_types, first_id, last_id, latency = shard
+    PeopleData.configure_connections(database, per_thread=False)
+    PeopleData.latency = latency
+    badge_classes = {
+        person_type: load_badge_class(class_path)
+        for person_type, _header, class_path in BADGE_SECTIONS
+        if person_type in person_types
+    }
+    badges_by_type = {person_type: [] for person_type in person_types}
+    started = time.perf_counter()
+    people = PeopleData().iter_people_grouped_by_type(
+        person_types, first_id=first_id, last_id=last_id
+    )
+    try:
+        for person in people:
+            badge_class = badge_classes[person.type]
+            badge_text = badge_class.get_badge_text_from_row(person)
+            badges_by_type[person.type].append((person, badge_text))
+    except PeopleData.connection.DataError:
+        # Nobody of these types in this range.
+        pass
+    stats = {
+        "pid": os.getpid(),
+        "badges": sum(len(badges) for badges in badges_by_type.values()),
+        "seconds": time.perf_counter() - started,
+    }
+    return badges_by_type, stats
+
 
 if __name__ == "__main__":
     # Setup and run the application.
-    utils.initialize_logging()
+    # Log writes happen on a background thread, off the badge-printing path.
+    utils.initialize_logging(queued=True)
     result = BadgeApp(sys.argv[1:]).run()
     sys.exit(result)
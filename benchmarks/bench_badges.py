@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for the badge pipeline on synthetic rosters.
+
+For each roster size this builds a fresh in-memory database of made-up
+people and measures:
+
+    badge_app_run    `BadgeApp.run()` end to end (output to /dev/null), on
+                     an app already set up, so startup isn't included
+    get_person_by_id, get_name_by_id, get_title_by_id
+                     single lookups of random IDs
+    get_people_by_ids
+                     bulk lookups, `--batch-size` random IDs at a time
+    get_people_by_type, get_all_people
+                     whole-section and whole-table queries
+
+and reports throughput (rows or calls per second), p50/p99 latency per
+call and the peak memory traced while the measurement ran. The whole-roster
+measurements run `--repeats` times each, so their percentiles come from
+more than one sample. Results are
+written as JSON so runs on different commits can be compared, e.g.
+
+    python benchmarks/bench_badges.py --sizes 1000,100000 --output bench.json
+
+The simulated query cost defaults to zero ("--latency none"), so the
+numbers show the cost of our own code; see people/latency.py.
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# Run from anywhere: the project root holds badges.py and the people package.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from badges import BadgeApp, BADGE_SECTIONS  # noqa: E402
+from people.people_data import PeopleData  # noqa: E402
+from people.latency import LatencyModel  # noqa: E402
+from people.backends import ENGINES  # noqa: E402
+
+FIRST_NAMES = ["Alice", "Brenda", "Charlie", "Darla", "Ella", "Francis", "George"]
+TITLES = {
+    "STUDENT": ["Freshman at Stanford", "Senior at Cal", "Sophomore at UCLA"],
+    "EMPLOYEE": ["Developer", "Manager", "Analyst", "QA"],
+    "VOLUNTEER": ["Intern", "Usher", "Greeter"],
+}
+
+
+def synthetic_people(size, seed=0):
+    """
+    Yield `size` made-up (id, name, title, type) rows, starting at ID 1000
+    so they never clash with the built-in test data.
+    """
+    generator = random.Random(seed)
+    person_types = [person_type for person_type, _, _ in BADGE_SECTIONS]
+    for _id in range(1000, 1000 + size):
+        person_type = generator.choice(person_types)
+        name = f"{generator.choice(FIRST_NAMES)} {_id}"
+        yield _id, name, generator.choice(TITLES[person_type]), person_type
+
+
+def build_roster(size, chunk_size=50000):
+    """
+    Point PeopleData at a brand new in-memory database holding `size`
+    synthetic people (plus the usual test data).
+    """
+    PeopleData.configure_connections(":memory:", per_thread=False)
+    PeopleData.disable_cache()
+    PeopleData.initialize_data()
+    rows = synthetic_people(size)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        PeopleData.insert_people(chunk)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def measure(name, size, function, calls=1, rows_per_call=None):
+    """
+    Call `function` `calls` times, timing each call, then once more under
+    tracemalloc for the peak memory (tracing slows Python down, so it is
+    kept out of the timings). `rows_per_call` turns calls per second into
+    rows per second.
+    """
+    durations = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    durations.sort()
+    total = sum(durations)
+    result = {
+        "benchmark": name,
+        "roster_size": size,
+        "calls": calls,
+        "total_seconds": total,
+        "calls_per_second": calls / total if total else None,
+        "p50_seconds": percentile(durations, 0.50),
+        "p99_seconds": percentile(durations, 0.99),
+        "mean_seconds": statistics.mean(durations),
+        "peak_memory_bytes": peak_bytes,
+    }
+    if rows_per_call is not None:
+        result["rows_per_second"] = rows_per_call * calls / total if total else None
+    print(
+        f"{name:>20} {size:>9,} people: p50 {result['p50_seconds'] * 1000:9.3f} ms,"
+        f" p99 {result['p99_seconds'] * 1000:9.3f} ms,"
+        f" peak {peak_bytes / 1e6:8.1f} MB",
+        file=sys.stderr,
+    )
+    return result
+
+
+def run_benchmarks(size, lookups, batch_size, backend="sqlite", repeats=5):
+    build_roster(size)
+    PeopleData.use_backend(backend)
+    people = PeopleData()
+    roster_size = len(PeopleData.known_ids)
+    ids = random.Random(1).choices(sorted(PeopleData.known_ids), k=lookups)
+    id_iterator = itertools.cycle(ids)
+    results = []
+
+    # Set up outside the timings: BadgeApp() initializes the data (and, for
+    # another backend, copies the whole table), which isn't part of run().
+    app = BadgeApp(["--backend", backend])
+
+    def run_app():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            app.run()
+
+    results.append(
+        measure(
+            "badge_app_run", size, run_app, calls=repeats, rows_per_call=roster_size
+        )
+    )
+    for method_name in ("get_person_by_id", "get_name_by_id", "get_title_by_id"):
+        method = getattr(people, method_name)
+        results.append(
+            measure(
+                method_name,
+                size,
+                lambda: method(next(id_iterator)),
+                calls=lookups,
+                rows_per_call=1,
+            )
+        )
+
+    def bulk_lookup():
+        people.get_people_by_ids(random.sample(ids, min(batch_size, len(ids))))
+
+    results.append(
+        measure(
+            "get_people_by_ids",
+            size,
+            bulk_lookup,
+            calls=max(1, lookups // batch_size),
+            rows_per_call=batch_size,
+        )
+    )
+    results.append(
+        measure(
+            "get_people_by_type",
+            size,
+            lambda: people.get_people_by_type("EMPLOYEE"),
+            calls=repeats,
+            rows_per_call=roster_size / len(BADGE_SECTIONS),
+        )
+    )
+    results.append(
+        measure(
+            "get_all_people",
+            size,
+            people.get_all_people,
+            calls=repeats,
+            rows_per_call=roster_size,
+        )
+    )
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Benchmark the badge pipeline.")
+    parser.add_argument(
+        "--sizes",
+        help="Comma-separated roster sizes (default: 1000,10000,100000,1000000)",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[1000, 10000, 100000, 1000000],
+    )
+    parser.add_argument(
+        "--latency",
+        help="Simulated query cost, in the format of badges.py --latency",
+        default="none",
+    )
+    parser.add_argument(
+        "--lookups", help="Single-ID lookups per method", type=int, default=1000
+    )
+    parser.add_argument(
+        "--batch-size", help="IDs per get_people_by_ids call", type=int, default=100
+    )
+    parser.add_argument(
+        "--repeats",
+        help="Calls per whole-roster measurement (default: 5)",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "--backend",
+        help="Engine answering the lookups (default: sqlite)",
+        choices=["sqlite"] + sorted(ENGINES),
+        default="sqlite",
+    )
+    parser.add_argument("--output", help="Write the JSON results here, not stdout")
+    args = parser.parse_args(arguments)
+    PeopleData.latency = LatencyModel.from_spec(args.latency)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": args.latency,
+        "backend": args.backend,
+        "results": [],
+    }
+    for size in args.sizes:
+        report["results"].extend(
+            run_benchmarks(
+                size, args.lookups, args.batch_size, args.backend, args.repeats
+            )
+        )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
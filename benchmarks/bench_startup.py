@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+How long a short `badges.py` run takes to start, and whether it fits the
+startup budget.
+
+Each scenario runs `badges.py --explain` (start up, print a few lines,
+exit) in a fresh process, `--runs` times:
+
+    interpreter    `python -c pass`: the floor nothing here can improve
+    rebuild        build the database from scratch, as a plain run does
+    snapshot       copy a prebuilt snapshot into memory (`--snapshot`)
+    mmap           use the snapshot read-only and memory-mapped (`--mmap`)
+
+With `--size N` the database also holds N synthetic people; the rebuild
+scenario loads them from a CSV file, the snapshots already have them.
+Results are written as JSON, like bench_badges.py. The script exits with
+status 1 if the snapshot scenario's median, less the interpreter's, is
+over `--budget` seconds, so it can guard against startup regressions:
+
+    python benchmarks/bench_startup.py --size 100000 --output startup.json
+"""
+
+import argparse
+import csv
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Importing bench_badges also puts the project root on sys.path.
+from bench_badges import build_roster, git_commit, percentile, synthetic_people
+from people.people_data import PeopleData
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def build_snapshot(directory, size):
+    """
+    Write the synthetic roster to a CSV file, and the whole database
+    (built-in data plus roster) to a snapshot. Returns both paths.
+    """
+    csv_path = Path(directory) / "roster.csv"
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["id", "name", "title", "type"])
+        writer.writerows(synthetic_people(size))
+    snapshot_path = Path(directory) / "snapshot.db"
+    build_roster(size)
+    PeopleData.save_snapshot(snapshot_path)
+    return csv_path, snapshot_path
+
+
+def time_runs(name, command, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    result = {
+        "scenario": name,
+        "runs": runs,
+        "p50_seconds": percentile(durations, 0.50),
+        "p99_seconds": percentile(durations, 0.99),
+        "min_seconds": durations[0],
+    }
+    print(
+        f"{name:>12}: p50 {result['p50_seconds'] * 1000:8.1f} ms,"
+        f" p99 {result['p99_seconds'] * 1000:8.1f} ms",
+        file=sys.stderr,
+    )
+    return result
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Benchmark badges.py startup.")
+    parser.add_argument(
+        "--size", help="Synthetic people in the database", type=int, default=0
+    )
+    parser.add_argument("--runs", help="Runs per scenario", type=int, default=20)
+    parser.add_argument(
+        "--budget",
+        help="Allowed startup for the snapshot scenario, in seconds, on top of"
+        " the interpreter's own (default: 0.15)",
+        type=float,
+        default=0.15,
+    )
+    parser.add_argument("--output", help="Write the JSON results here, not stdout")
+    args = parser.parse_args(arguments)
+
+    badges = [sys.executable, str(ROOT / "badges.py"), "--latency", "none"]
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path, snapshot_path = build_snapshot(directory, args.size)
+        rebuild = badges + (["--load", str(csv_path)] if args.size else [])
+        snapshot = badges + ["--snapshot", str(snapshot_path)]
+        scenarios = [
+            ("interpreter", [sys.executable, "-c", "pass"]),
+            ("rebuild", rebuild + ["--explain"]),
+            ("snapshot", snapshot + ["--explain"]),
+            ("mmap", snapshot + ["--mmap", "--explain"]),
+        ]
+        results = [time_runs(name, command, args.runs) for name, command in scenarios]
+
+    by_scenario = {result["scenario"]: result for result in results}
+    startup = by_scenario["snapshot"]["p50_seconds"]
+    startup -= by_scenario["interpreter"]["p50_seconds"]
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "roster_size": args.size,
+        "budget_seconds": args.budget,
+        "startup_seconds": startup,
+        "within_budget": startup <= args.budget,
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+    if not report["within_budget"]:
+        print(
+            f"Startup took {startup * 1000:.1f} ms,"
+            f" over the {args.budget * 1000:.1f} ms budget.",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""
+Load-test the badge server (`badges.py --serve`, see people/server.py).
+
+Starts a server in its own process (or uses one already running, with
+`--port`), then has `--clients` threads, each with its own keep-alive
+BadgeClient, send requests back to back for `--duration` seconds:
+
+    badge      one random ID per request
+    batch      `--batch-size` random IDs per request
+    section    a whole random section per request
+
+and reports requests per second and p50/p90/p99/max latency, as JSON
+like the other benchmarks:
+
+    python benchmarks/load_badges.py --size 100000 --clients 8 --mix badge
+
+The server runs with `--latency none` unless told otherwise, so this
+measures the serving path itself.
+"""
+
+import argparse
+import json
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Importing bench_badges also puts the project root on sys.path.
+from bench_badges import git_commit, percentile
+from bench_startup import ROOT, build_snapshot
+from people.client import BadgeClient
+
+MIXES = ("badge", "batch", "section")
+SECTION_TYPES = ["STUDENT", "EMPLOYEE", "VOLUNTEER"]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(port, snapshot_path, latency, backend):
+    server = subprocess.Popen(
+        [sys.executable, str(ROOT / "badges.py"), "--serve", str(port)]
+        + ["--snapshot", str(snapshot_path), "--latency", latency]
+        + ["--backend", backend]
+    )
+    # Wait until it takes connections.
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("The badge server didn't start")
+
+
+def client_loop(port, mix, ids, batch_size, stop_at, seed, durations, errors):
+    generator = random.Random(seed)
+    client = BadgeClient(port)
+    try:
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                if mix == "badge":
+                    client.badge(generator.choice(ids))
+                elif mix == "batch":
+                    client.badges(generator.choices(ids, k=batch_size))
+                else:
+                    client.section(generator.choice(SECTION_TYPES))
+            except (LookupError, RuntimeError, OSError):
+                errors.append(1)
+                continue
+            durations.append(time.perf_counter() - start)
+    finally:
+        client.close()
+
+
+def run_load(port, mix, ids, clients, duration, batch_size):
+    durations = []
+    errors = []
+    stop_at = time.perf_counter() + duration
+    threads = [
+        threading.Thread(
+            target=client_loop,
+            args=(port, mix, ids, batch_size, stop_at, seed, durations, errors),
+        )
+        for seed in range(clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    durations.sort()
+    result = {
+        "mix": mix,
+        "clients": clients,
+        "requests": len(durations),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "requests_per_second": len(durations) / elapsed,
+        "p50_seconds": percentile(durations, 0.50) if durations else None,
+        "p90_seconds": percentile(durations, 0.90) if durations else None,
+        "p99_seconds": percentile(durations, 0.99) if durations else None,
+        "max_seconds": durations[-1] if durations else None,
+    }
+    if durations:
+        print(
+            f"{mix:>8} x {clients} clients: {result['requests_per_second']:9.0f} req/s,"
+            f" p50 {result['p50_seconds'] * 1000:7.2f} ms,"
+            f" p99 {result['p99_seconds'] * 1000:7.2f} ms,"
+            f" {len(errors)} errors",
+            file=sys.stderr,
+        )
+    return result
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Load-test the badge server.")
+    parser.add_argument(
+        "--port", help="Use the server already running on this port", type=int
+    )
+    parser.add_argument(
+        "--size", help="Synthetic people for a started server", type=int, default=0
+    )
+    parser.add_argument(
+        "--latency",
+        help="Simulated query cost for a started server (default: none)",
+        default="none",
+    )
+    parser.add_argument(
+        "--backend", help="Backend for a started server (default: sqlite)"
+    )
+    parser.add_argument(
+        "--mix",
+        help="Comma-separated request kinds to run, one after the other"
+        f" (default: {','.join(MIXES)})",
+        type=lambda value: value.split(","),
+        default=list(MIXES),
+    )
+    parser.add_argument("--clients", help="Concurrent clients", type=int, default=4)
+    parser.add_argument(
+        "--duration", help="Seconds per request kind", type=float, default=5
+    )
+    parser.add_argument(
+        "--batch-size", help="IDs per batch request", type=int, default=20
+    )
+    parser.add_argument("--output", help="Write the JSON results here, not stdout")
+    args = parser.parse_args(arguments)
+    unknown_mixes = set(args.mix) - set(MIXES)
+    if unknown_mixes:
+        parser.error(f"unknown request kinds: {', '.join(sorted(unknown_mixes))}")
+
+    # The built-in people, plus the synthetic ones (see bench_badges.py).
+    ids = list(range(1, 9)) + list(range(1000, 1000 + args.size))
+    server = None
+    with tempfile.TemporaryDirectory() as directory:
+        port = args.port
+        if port is None:
+            _csv_path, snapshot_path = build_snapshot(directory, args.size)
+            port = free_port()
+            server = start_server(
+                port, snapshot_path, args.latency, args.backend or "sqlite"
+            )
+        try:
+            results = [
+                run_load(port, mix, ids, args.clients, args.duration, args.batch_size)
+                for mix in args.mix
+            ]
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "roster_size": args.size,
+        "latency": args.latency if server else None,
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
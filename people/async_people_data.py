@@ -0,0 +1,184 @@
+"""
+An asyncio front end for PeopleData.
+
+Each `get_*` method of PeopleData has a coroutine twin here. The
+simulated cost of a query becomes `await asyncio.sleep()`, and the
+(blocking) sqlite work runs on the event loop's default executor, so
+while one query is "waiting on the network" the others can proceed.
+
+A semaphore caps how many queries are in flight at once. When PeopleData
+answers from an in-process engine (see backends.py) there is nothing to
+wait for, and the coroutines return its results straight away.
+
+NOTE: Create AsyncPeopleData inside a running event loop (i.e. from a
+coroutine), so the semaphore belongs to that loop.
+"""
+
+import asyncio
+import logging
+import time
+from people.metrics import find_caller
+from people.people_data import (
+    PeopleData,
+    MAX_QUERY_PARAMETERS,
+    PERSON_BY_ID_QUERY,
+    ALL_PEOPLE_QUERY,
+    PEOPLE_BY_TYPE_QUERY,
+    PEOPLE_PAGE_QUERY,
+    PEOPLE_BY_TYPE_PAGE_QUERY,
+    DEFAULT_PAGE_SIZE,
+    _BEFORE_FIRST_ID,
+    is_id_lookup,
+)
+
+
+class AsyncPeopleData(object):
+    def __init__(self, people_data=None, max_concurrency=8):
+        # All the real work, and the cache, are shared with a plain PeopleData.
+        self.people_data = people_data or PeopleData()
+        if max_concurrency < 1:
+            # A Semaphore(0) would never let a query through.
+            raise ValueError(f"max_concurrency must be at least 1: {max_concurrency}")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _query(self, query_string, parameters=None):
+        """
+        The coroutine version of `PeopleData._query()`.
+        """
+        metrics = self.people_data.metrics
+        if metrics is None:
+            return await self._cached_query(query_string, parameters)
+        started = time.perf_counter()
+        row_count = 0
+        try:
+            result = await self._cached_query(query_string, parameters)
+            row_count = len(result)
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            metrics.record_query(query_string, find_caller(self), row_count, seconds)
+
+    async def _cached_query(self, query_string, parameters=None):
+        cache = self.people_data.cache
+        if cache is not None:
+            cache_key = cache.make_key(query_string, parameters)
+            cached_result = cache.get(cache_key)
+            if cached_result is not None:
+                logging.debug("Cache hit, returning cached results.")
+                return cached_result
+        async with self._semaphore:
+            # Wait a while here to show "cost", without blocking anyone else.
+            latency = self.people_data.latency
+            await asyncio.sleep(latency.query_cost())
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, self.people_data._execute, query_string, parameters
+            )
+            if latency.per_row:
+                await asyncio.sleep(latency.rows_cost(len(result)))
+        if cache is not None:
+            cache.put(cache_key, result, by_id=is_id_lookup(query_string))
+        logging.debug("Completed async query, returning results.")
+        return result
+
+    async def get_person_by_id(self, query_id):
+        if self.people_data.backend is not None:
+            return self.people_data.backend.get_person_by_id(query_id)
+        if self.people_data._is_known_missing(query_id):
+            raise self.people_data.connection.DataError(
+                f"No person with ID {query_id} in database (rejected without a query)."
+            )
+        try:
+            result = await self._query(PERSON_BY_ID_QUERY, [query_id])
+        except self.people_data.connection.DataError:
+            self.people_data._remember_missing(query_id)
+            raise
+        logging.debug("Completed get_person_by_id: %s.", result)
+        return result[0]
+
+    async def get_name_by_id(self, query_id):
+        return (await self.get_person_by_id(query_id))[1]
+
+    async def get_title_by_id(self, query_id):
+        return (await self.get_person_by_id(query_id))[2]
+
+    async def get_people_by_ids(self, query_ids):
+        """
+        Like `PeopleData.get_people_by_ids()`, but the `IN (...)` chunks are
+        all in flight at the same time.
+        """
+        if self.people_data.backend is not None:
+            return self.people_data.backend.get_people_by_ids(query_ids)
+        requested_ids = list(dict.fromkeys(query_ids))
+        unique_ids = [
+            _id for _id in requested_ids if not self.people_data._is_known_missing(_id)
+        ]
+
+        async def query_chunk(chunk):
+            placeholders = ", ".join("?" * len(chunk))
+            try:
+                return await self._query(
+                    f"SELECT * FROM people WHERE id IN ({placeholders})", chunk
+                )
+            except self.people_data.connection.DataError:
+                return []
+
+        chunks = [
+            unique_ids[start : start + MAX_QUERY_PARAMETERS]
+            for start in range(0, len(unique_ids), MAX_QUERY_PARAMETERS)
+        ]
+        rows_by_id = {}
+        for rows in await asyncio.gather(*(query_chunk(chunk) for chunk in chunks)):
+            for row in rows:
+                rows_by_id[row[0]] = row
+        for _id in unique_ids:
+            if _id not in rows_by_id:
+                self.people_data._remember_missing(_id)
+        if not rows_by_id:
+            raise self.people_data.connection.DataError(
+                f"No matching results found in database for IDs: {requested_ids}"
+            )
+        return [rows_by_id[_id] for _id in unique_ids if _id in rows_by_id]
+
+    async def get_all_people(self):
+        if self.people_data.backend is not None:
+            return self.people_data.backend.get_all_people()
+        return await self._query(ALL_PEOPLE_QUERY)
+
+    async def get_people_by_type(self, query_type):
+        if self.people_data.backend is not None:
+            return self.people_data.backend.get_people_by_type(query_type)
+        result = await self._query(PEOPLE_BY_TYPE_QUERY, [query_type])
+        logging.debug(
+            "Completed get_people_by_type for '%s', returned %d rows.",
+            query_type,
+            len(result),
+        )
+        return result
+
+    async def get_all_people_page(self, after_id=None, page_size=DEFAULT_PAGE_SIZE):
+        if self.people_data.backend is not None:
+            return self.people_data.backend.get_all_people_page(after_id, page_size)
+        return await self._page(PEOPLE_PAGE_QUERY, [], after_id, page_size)
+
+    async def get_people_by_type_page(
+        self, query_type, after_id=None, page_size=DEFAULT_PAGE_SIZE
+    ):
+        backend = self.people_data.backend
+        if backend is not None:
+            return backend.get_people_by_type_page(query_type, after_id, page_size)
+        return await self._page(
+            PEOPLE_BY_TYPE_PAGE_QUERY, [query_type], after_id, page_size
+        )
+
+    async def _page(self, query_string, parameters, after_id, page_size):
+        """
+        The coroutine version of `PeopleData._page()`.
+        """
+        if after_id is None:
+            after_id = _BEFORE_FIRST_ID
+        try:
+            people = await self._query(query_string, parameters + [after_id, page_size])
+        except self.people_data.connection.DataError:
+            return [], None
+        token = people[-1].id if len(people) == page_size else None
+        return people, token
@@ -0,0 +1,160 @@
+"""
+Storage engines PeopleData can answer its lookups from, instead of sqlite.
+
+sqlite stays the database of record: it holds the schema, the change log
+and the snapshots, and every write goes to it. An engine is a read-side
+copy of the `people` table that PeopleData keeps in step (see
+`PeopleData.use_backend()`); once one is in use, the lookups
+
+    get_person_by_id (and so get_name_by_id, get_title_by_id)
+    get_people_by_ids, get_people_by_type, get_all_people
+    get_all_people_page, get_people_by_type_page
+    iter_all_people, iter_people_by_type, iter_people_grouped_by_type
+
+are answered by the engine, with exactly the results sqlite would give,
+in the same order, and the same `DataError` when nothing matches. An
+engine lives in this process, so there is no simulated round trip (see
+latency.py), and no result cache or loader in front of it either.
+
+    memory    `MemoryBackend`: a dict keyed by ID, plus the IDs of each
+              type, so every lookup is a hash lookup with no SQL to parse
+"""
+
+import bisect
+import logging
+import sqlite3
+from people.person import Person
+
+
+class MemoryBackend(object):
+    def __init__(self, rows=()):
+        self._people = {}
+        # {type: {id: None}}, the secondary index for the section queries.
+        self._ids_by_type = {}
+        # Sorted views of the above, built when first asked for and thrown
+        # away on every write: {type: ([Person], [their IDs])}, and None for
+        # everybody. The IDs are there for binary searches.
+        self._sorted = {}
+        self.upsert(rows)
+
+    @classmethod
+    def from_connection(cls, connection):
+        """
+        A new engine holding a copy of every row in `connection`'s table.
+        """
+        cursor = connection.cursor()
+        cursor.row_factory = Person.row_factory
+        backend = cls(cursor.execute("SELECT * FROM people"))
+        logging.debug("Copied %d people into a MemoryBackend.", len(backend))
+        return backend
+
+    def __len__(self):
+        return len(self._people)
+
+    def upsert(self, rows):
+        """
+        Add (id, name, title, type) rows, replacing anybody already here.
+        """
+        for row in rows:
+            person = row if type(row) is Person else Person(*row)
+            previous = self._people.get(person.id)
+            if previous is not None:
+                self._ids_by_type[previous.type].pop(person.id, None)
+            self._people[person.id] = person
+            self._ids_by_type.setdefault(person.type, {})[person.id] = None
+        self._sorted.clear()
+
+    def delete(self, ids):
+        for _id in ids:
+            person = self._people.pop(_id, None)
+            if person is not None:
+                self._ids_by_type[person.type].pop(_id, None)
+        self._sorted.clear()
+
+    def _sorted_view(self, query_type):
+        """
+        (people, their IDs) for everybody of `query_type` (or everybody,
+        for None) in ID order, the order sqlite returns rows in.
+        """
+        view = self._sorted.get(query_type)
+        if view is None:
+            if query_type is None:
+                ids = self._people
+            else:
+                ids = self._ids_by_type.get(query_type, ())
+            sorted_ids = sorted(ids)
+            people = [self._people[_id] for _id in sorted_ids]
+            view = self._sorted[query_type] = (people, sorted_ids)
+        return view
+
+    def _people_of_type(self, query_type):
+        return self._sorted_view(query_type)[0]
+
+    def _no_results(self, what):
+        return sqlite3.DataError(f"No matching results found in database for {what}")
+
+    def get_person_by_id(self, query_id):
+        try:
+            return self._people[query_id]
+        except KeyError:
+            raise self._no_results(f"ID: {query_id}") from None
+
+    def get_people_by_ids(self, query_ids):
+        requested_ids = list(dict.fromkeys(query_ids))
+        result = [self._people[_id] for _id in requested_ids if _id in self._people]
+        if not result:
+            raise self._no_results(f"IDs: {requested_ids}")
+        return result
+
+    def get_people_by_type(self, query_type):
+        result = self._people_of_type(query_type)
+        if not result:
+            raise self._no_results(f"type: '{query_type}'")
+        return list(result)
+
+    def get_all_people(self):
+        result = self._people_of_type(None)
+        if not result:
+            raise self._no_results("everybody")
+        return list(result)
+
+    def get_all_people_page(self, after_id, page_size):
+        return self._page(None, after_id, page_size)
+
+    def get_people_by_type_page(self, query_type, after_id, page_size):
+        return self._page(query_type, after_id, page_size)
+
+    def _page(self, query_type, after_id, page_size):
+        people, ids = self._sorted_view(query_type)
+        start = 0
+        if after_id is not None:
+            # The sorted IDs make this a binary search, like sqlite's seek.
+            start = bisect.bisect_right(ids, after_id)
+        page = people[start : start + page_size]
+        token = page[-1].id if len(page) == page_size else None
+        return page, token
+
+    # Like sqlite's streaming queries, these are generators: the DataError
+    # for an empty result comes with the first `next()`, not the call.
+    def iter_all_people(self, batch_size=None):
+        yield from self.get_all_people()
+
+    def iter_people_by_type(self, query_type, batch_size=None):
+        yield from self.get_people_by_type(query_type)
+
+    def iter_people_grouped_by_type(
+        self, query_types, batch_size=None, first_id=None, last_id=None
+    ):
+        people = []
+        # A type listed twice still only comes out once, as in sqlite.
+        for query_type in dict.fromkeys(query_types):
+            people.extend(self._people_of_type(query_type))
+        if first_id is not None and last_id is not None:
+            people = [person for person in people if first_id <= person.id <= last_id]
+        if not people:
+            raise self._no_results(f"types: {list(query_types)}")
+        yield from people
+
+
+# Every engine `PeopleData.use_backend()` accepts, besides "sqlite" itself.
+ENGINES = {"memory": MemoryBackend}
@@ -0,0 +1,64 @@
+"""
+A file of previously rendered badges, for incremental runs.
+
+Alongside the badges it remembers which database they came from and the
+change watermark they are up to date with (see
+`PeopleData.current_change()`), so the next run only has to re-render
+the people that changed since.
+"""
+
+import json
+import logging
+import os
+from people.person import Person
+
+
+class BadgeCache(object):
+    def __init__(self, database_id, person_types, watermark=0, badges=None):
+        self.database_id = database_id
+        self.person_types = list(person_types)
+        self.watermark = watermark
+        # {id: (Person, badge text)}
+        self.badges = badges or {}
+
+    @classmethod
+    def load(cls, path):
+        """
+        The cache saved at `path`, or None if there isn't a usable one.
+        """
+        try:
+            with open(path) as cache_file:
+                saved = json.load(cache_file)
+            badges = {
+                int(_id): (Person(int(_id), *fields), badge_text)
+                for _id, (fields, badge_text) in saved["badges"].items()
+            }
+            return cls(
+                saved["database_id"], saved["person_types"], saved["watermark"], badges
+            )
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logging.info("No usable badge cache at %s (%s).", path, error)
+            return None
+
+    def save(self, path):
+        """
+        Write the cache to `path`; a crash half way leaves the old one intact.
+        """
+        saved = {
+            "database_id": self.database_id,
+            "person_types": self.person_types,
+            "watermark": self.watermark,
+            "badges": {
+                _id: [list(person[1:]), badge_text]
+                for _id, (person, badge_text) in self.badges.items()
+            },
+        }
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as cache_file:
+            json.dump(saved, cache_file)
+        os.replace(temporary_path, path)
+
+    def matches(self, database_id, person_types):
+        return self.database_id == database_id and self.person_types == list(
+            person_types
+        )
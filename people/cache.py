@@ -0,0 +1,109 @@
+"""
+A small read-through cache for PeopleData query results.
+
+Every lookup through `PeopleData._query()` pays the (simulated) cost of
+a round trip to the database. When the same person is looked up again
+and again, e.g. `get_name_by_id()` and `get_title_by_id()` for one badge,
+the cache turns the repeat visits into a dictionary access.
+
+The cache is opt-in: nothing is cached until `PeopleData.enable_cache()`
+is called.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache(object):
+    """
+    Least-recently-used cache keyed by (query string, parameters), with a
+    time-to-live on each entry. An OrderedDict keeps the entries in use
+    order: hits move to the end, evictions come off the front. A lock
+    keeps it consistent when several threads share it (e.g. badges.py
+    --serve, which answers each request on its own thread).
+    """
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        self.max_size = max_size
+        # Seconds an entry stays valid; None means forever.
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query_string, parameters=None):
+        return query_string, tuple(parameters or ())
+
+    def get(self, key):
+        """
+        Return the cached rows for `key`, or None on a miss (including an
+        entry that has outlived its TTL).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, rows, _ids = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return list(rows)
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, rows, by_id=False):
+        """
+        Cache `rows` for `key`. `by_id` says the query looked people up by
+        ID, so only a change to one of those people can alter its result.
+        Anything else (a section, the whole roster, a page) can gain or
+        lose rows whenever anybody changes.
+        """
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        # Remember which people are in an ID lookup, so `invalidate()` can
+        # find every entry that mentions them; None means "everybody".
+        ids = None
+        if by_id:
+            ids = frozenset(row[0] for row in rows) | frozenset(key[1])
+        with self._lock:
+            self._entries[key] = (expires_at, list(rows), ids)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, _id):
+        """
+        Drop every entry that looked up, or returned, the person `_id`,
+        and every entry that wasn't an ID lookup: a person added, removed
+        or moved to another type may belong in any of those.
+        """
+        with self._lock:
+            stale_keys = [
+                key
+                for key, entry in self._entries.items()
+                if entry[2] is None or _id in entry[2]
+            ]
+            for key in stale_keys:
+                del self._entries[key]
+        logging.debug("Invalidated %d cache entries for ID %s.", len(stale_keys), _id)
+        return len(stale_keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,52 @@
+"""
+A small client for the badge server (see server.py).
+
+One BadgeClient keeps one connection open and reuses it for every
+request, so it should stay on one thread; give each thread its own.
+
+    client = BadgeClient(8765)
+    client.badge(6)              # "#6 - Francis (QA)"
+    client.badges([6, 2, 99])    # {6: "#6 - ...", 2: "HI! ..."}
+    client.section("volunteer")  # [(4, "** Darla (Intern) **"), ...]
+
+An ID or type the server doesn't know raises LookupError.
+"""
+
+import http.client
+import json
+
+
+class BadgeClient(object):
+    def __init__(self, port, host="127.0.0.1", timeout=10):
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _get(self, path):
+        self.connection.request("GET", path)
+        response = self.connection.getresponse()
+        # Read the whole body, or the connection can't be used again.
+        body = json.loads(response.read())
+        if response.status == 404:
+            raise LookupError(body["error"])
+        if response.status != 200:
+            raise RuntimeError(f"{response.status} from server: {body['error']}")
+        return body
+
+    def badge(self, _id):
+        return self._get(f"/badge/{_id}")["badge"]
+
+    def badges(self, ids):
+        """
+        {id: badge text} for each of `ids` that has a badge.
+        """
+        path = f"/badges?ids={','.join(str(_id) for _id in ids)}"
+        return {badge["id"]: badge["badge"] for badge in self._get(path)["badges"]}
+
+    def section(self, person_type):
+        """
+        [(id, badge text)] for everybody of `person_type`, in ID order.
+        """
+        badges = self._get(f"/section/{person_type}")["badges"]
+        return [(badge["id"], badge["badge"]) for badge in badges]
+
+    def close(self):
+        self.connection.close()
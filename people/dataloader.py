@@ -0,0 +1,210 @@
+"""
+DataLoader-style request coalescing for per-ID lookups.
+
+The badge classes ask for one field of one person at a time:
+`get_name_by_id(7)`, then `get_title_by_id(7)`, while other threads ask
+about 3 and 12. Each of those calls would be its own query. A loader
+collects the IDs asked for within a short window (threads) or a single
+event-loop tick (asyncio), looks them all up with one
+`get_people_by_ids()` query, and hands each caller its own row. Identical
+IDs are only asked for once, and by default the rows are remembered (in
+a QueryCache, so only so many and only for so long), so the
+name-then-title pattern costs one query rather than two.
+
+`PersonLoader` plugs in underneath the existing API: after
+`PeopleData.enable_loader()`, `get_person_by_id()` (and so the name and
+title lookups that Student, Employee and Volunteer use) goes through it
+without any change to those classes. `AsyncPersonLoader` does the same for
+coroutines.
+"""
+
+import asyncio
+import threading
+from people.cache import QueryCache
+from people.people_data import PeopleData, MAX_QUERY_PARAMETERS, PERSON_BY_ID_QUERY
+
+
+def _row_key(_id):
+    # The key PeopleData's own cache would use for the same row, which also
+    # lets `QueryCache.invalidate()` find it by ID.
+    return QueryCache.make_key(PERSON_BY_ID_QUERY, (_id,))
+
+
+class _Batch(object):
+    """
+    IDs waiting for the same bulk query, and, once it has run, its results.
+    """
+
+    def __init__(self):
+        # A dict keeps the IDs unique and in the order they were asked for.
+        self.ids = {}
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.rows_by_id = {}
+        self.error = None
+
+
+class PersonLoader(object):
+    def __init__(
+        self,
+        people_data=None,
+        window=0.002,
+        max_batch_size=MAX_QUERY_PARAMETERS,
+        cache=True,
+        max_size=1024,
+        ttl=300.0,
+    ):
+        self.people_data = people_data or PeopleData()
+        # Seconds the first caller of a batch waits for others to join it.
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.cache = cache
+        self.batches = 0
+        self._rows = QueryCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self._pending = None
+
+    def load(self, _id):
+        """
+        The row for person `_id`, fetched together with whatever else has
+        been asked for in the meantime. Raises `DataError` if there's no
+        such person.
+        """
+        if self.cache:
+            cached = self._rows.get(_row_key(_id))
+            if cached is not None:
+                return cached[0]
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            batch.ids[_id] = None
+            if len(batch.ids) >= self.max_batch_size:
+                self._pending = None
+                batch.full.set()
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._pending is batch:
+                    self._pending = None
+            self._dispatch(batch)
+        else:
+            batch.done.wait()
+        return self._result(batch, _id)
+
+    def _dispatch(self, batch):
+        try:
+            rows = self.people_data.get_people_by_ids(list(batch.ids))
+            batch.rows_by_id = {row[0]: row for row in rows}
+        except Exception as error:
+            # Every caller waiting on the batch gets the same error.
+            batch.error = error
+        finally:
+            self.batches += 1
+            if self.cache:
+                for _id, row in batch.rows_by_id.items():
+                    self._rows.put(_row_key(_id), [row], by_id=True)
+            batch.done.set()
+
+    def _result(self, batch, _id):
+        row = batch.rows_by_id.get(_id)
+        if row is None:
+            raise batch.error or self.people_data.connection.DataError(
+                f"No matching results found in database for ID: {_id}"
+            )
+        return row
+
+    def clear(self, _id=None):
+        """
+        Forget the remembered row for `_id`, or every row.
+        """
+        if _id is None:
+            self._rows.clear()
+        else:
+            self._rows.invalidate(_id)
+
+    # The same lookups PeopleData offers, so a loader can also be handed
+    # to code that takes a data source (like Volunteer.get_badge_text).
+    def get_person_by_id(self, query_id):
+        return self.load(query_id)
+
+    def get_name_by_id(self, query_id):
+        return self.load(query_id)[1]
+
+    def get_title_by_id(self, query_id):
+        return self.load(query_id)[2]
+
+
+class AsyncPersonLoader(object):
+    """
+    The asyncio flavor: every `load()` made before the event loop next gets
+    around to its callbacks (one "tick") ends up in the same batch.
+    """
+
+    def __init__(self, async_people_data, cache=True, max_size=1024, ttl=300.0):
+        self.async_people_data = async_people_data
+        self.cache = cache
+        self.batches = 0
+        self._rows = QueryCache(max_size=max_size, ttl=ttl)
+        self._pending = None
+        # The event loop only keeps weak references to tasks.
+        self._tasks = set()
+
+    async def load(self, _id):
+        if self.cache:
+            cached = self._rows.get(_row_key(_id))
+            if cached is not None:
+                return cached[0]
+        if self._pending is None:
+            self._pending = {}
+            asyncio.get_running_loop().call_soon(self._dispatch)
+        future = self._pending.get(_id)
+        if future is None:
+            future = self._pending[_id] = asyncio.get_running_loop().create_future()
+        return await future
+
+    def _dispatch(self):
+        futures, self._pending = self._pending, None
+        task = asyncio.ensure_future(self._run(futures))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, futures):
+        data_error = self.async_people_data.people_data.connection.DataError
+        batch_error = None
+        rows = []
+        try:
+            rows = await self.async_people_data.get_people_by_ids(list(futures))
+        except Exception as error:
+            batch_error = error
+        self.batches += 1
+        rows_by_id = {row[0]: row for row in rows}
+        if self.cache:
+            for _id, row in rows_by_id.items():
+                self._rows.put(_row_key(_id), [row], by_id=True)
+        for _id, future in futures.items():
+            if _id in rows_by_id:
+                future.set_result(rows_by_id[_id])
+            else:
+                future.set_exception(
+                    batch_error
+                    or data_error(
+                        f"No matching results found in database for ID: {_id}"
+                    )
+                )
+
+    def clear(self, _id=None):
+        if _id is None:
+            self._rows.clear()
+        else:
+            self._rows.invalidate(_id)
+
+    async def get_person_by_id(self, query_id):
+        return await self.load(query_id)
+
+    async def get_name_by_id(self, query_id):
+        return (await self.load(query_id))[1]
+
+    async def get_title_by_id(self, query_id):
+        return (await self.load(query_id))[2]
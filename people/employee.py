@@ -8,6 +8,7 @@ Original Author: edc@mindthump.org
 
 import logging
 from people import people_data
+from people.person import Person
 
 
 class Employee(object):
@@ -18,8 +19,17 @@ class Employee(object):
 
     def get_badge_text(self):
         employee_data = people_data.PeopleData().get_person_by_id(self.employee_id)
-        employee_name = employee_data[1]
-        employee_title = employee_data[2]
+        # Person() also accepts a plain (id, name, title, type) tuple.
+        employee = Person(*employee_data)
+        employee_name = employee.name
+        employee_title = employee.title
         # Decorate the name with the employee number (the ID)
-        logging.debug(f"Employee name = {employee_name}")
+        logging.debug("Employee name = %s", employee_name)
         return f"#{self.employee_id} - {employee_name} ({employee_title})"
+
+    @classmethod
+    def get_badge_text_from_row(cls, row):
+        """
+        Render the badge from an already-fetched row, with no lookups.
+        """
+        return f"#{row[0]} - {row[1]} ({row[2]})"
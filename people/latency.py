@@ -0,0 +1,86 @@
+"""
+How much a trip to the (pretend) database costs.
+
+PeopleData sleeps for `latency.query_cost() + latency.rows_cost(rows)`
+seconds on every query, to stand in for a resource that lives "out there
+somewhere". The original hard-coded two seconds is `LatencyModel(fixed=2)`;
+benchmarks usually want `LatencyModel()`, which costs nothing at all.
+
+A model has three parts, all optional:
+
+    fixed     seconds charged once per query
+    per_row   seconds charged for every row returned
+    jitter    a random extra per query: "uniform:MAX" (0 to MAX seconds)
+              or "exponential:MEAN" (mostly small, occasionally large)
+
+On the command line a model is written as comma-separated key=value pairs,
+e.g. "fixed=0.05,per_row=0.00001,jitter=exponential:0.02,seed=42"; a bare
+number is a fixed cost and "none" is zero.
+"""
+
+import random
+
+
+class LatencyModel(object):
+    def __init__(self, fixed=0.0, per_row=0.0, jitter=None, seed=None):
+        self.fixed = fixed
+        self.per_row = per_row
+        self.jitter = jitter
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._jitter = self._make_jitter(jitter)
+
+    def _make_jitter(self, jitter):
+        if not jitter:
+            return None
+        distribution, _, parameter = jitter.partition(":")
+        parameter = float(parameter)
+        if distribution == "uniform":
+            return lambda: self._random.uniform(0, parameter)
+        if distribution == "exponential":
+            return lambda: self._random.expovariate(1 / parameter)
+        raise ValueError(f"Unknown jitter distribution: '{distribution}'")
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Build a model from its command-line form (see the module docstring).
+        """
+        if spec in ("", "none"):
+            return cls()
+        try:
+            return cls(fixed=float(spec))
+        except ValueError:
+            pass
+        settings = dict(item.split("=", 1) for item in spec.split(","))
+        return cls(
+            fixed=float(settings.get("fixed", 0)),
+            per_row=float(settings.get("per_row", 0)),
+            jitter=settings.get("jitter"),
+            seed=int(settings["seed"]) if "seed" in settings else None,
+        )
+
+    def __reduce__(self):
+        # The jitter function is a lambda, which can't be pickled; rebuild
+        # it instead (e.g. to hand the model to another process).
+        return type(self), (self.fixed, self.per_row, self.jitter, self.seed)
+
+    def query_cost(self):
+        """
+        Seconds to charge once for a query, whatever it returns.
+        """
+        if self._jitter is None:
+            return self.fixed
+        return self.fixed + self._jitter()
+
+    def rows_cost(self, row_count):
+        """
+        Seconds to charge for `row_count` rows coming back.
+        """
+        return self.per_row * row_count
+
+    def __repr__(self):
+        return (
+            f"LatencyModel(fixed={self.fixed}, per_row={self.per_row},"
+            f" jitter={self.jitter!r})"
+        )
@@ -0,0 +1,167 @@
+"""
+Optional instrumentation for PeopleData queries and badge rendering.
+
+Nothing is recorded until `PeopleData.enable_metrics()` is called; until
+then the only cost in the hot path is an `is None` check.
+
+Queries are grouped by *shape* (the SQL with any run of "?" placeholders
+folded into one, so bulk lookups of 3 and 300 IDs count together) and by
+the public PeopleData method the caller used. For each group we keep the
+call count, the rows returned, the total time and a latency histogram.
+Badge rendering is timed per badge class the same way.
+
+Hooks see every event as it happens: `metrics.add_hook(print)` prints a
+dict like {"kind": "query", "shape": ..., "caller": "get_name_by_id",
+"rows": 1, "seconds": 2.0}.
+"""
+
+import re
+import sys
+import threading
+
+# Upper bounds (seconds) of the histogram buckets; the last one catches the rest.
+HISTOGRAM_BOUNDS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, float("inf"))
+
+PLACEHOLDER_RUN = re.compile(r"\?(\s*,\s*\?)+")
+
+
+def query_shape(query_string):
+    return PLACEHOLDER_RUN.sub("?, ...", query_string)
+
+
+def find_caller(owner):
+    """
+    The outermost method of `owner` on the call stack, e.g.
+    `get_name_by_id` when that called `get_person_by_id`, which called
+    `_query`. Only used while metrics are enabled.
+    """
+    caller = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_locals.get("self") is owner:
+            caller = frame.f_code.co_name
+        frame = frame.f_back
+    return caller
+
+
+class Timings(object):
+    """
+    Count, total and histogram for one group of measurements. Not safe to
+    update from several threads at once; Metrics does that under its lock.
+    """
+
+    __slots__ = ("calls", "rows", "seconds", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.histogram = [0] * len(HISTOGRAM_BOUNDS)
+
+    def add(self, seconds, rows=0):
+        self.calls += 1
+        self.rows += rows
+        self.seconds += seconds
+        for index, bound in enumerate(HISTOGRAM_BOUNDS):
+            if seconds <= bound:
+                self.histogram[index] += 1
+                break
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "seconds": self.seconds,
+            "histogram": dict(zip(map(str, HISTOGRAM_BOUNDS), self.histogram)),
+        }
+
+
+class Metrics(object):
+    def __init__(self):
+        # {(shape, caller): Timings}
+        self.queries = {}
+        # {badge class name: Timings}
+        self.renders = {}
+        self.hooks = []
+        # Queries are recorded from whichever thread ran them (e.g. every
+        # request thread of badges.py --serve), and a read-modify-write of
+        # the counts could otherwise lose some.
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record_query(self, query_string, caller, rows, seconds):
+        shape = query_shape(query_string)
+        with self._lock:
+            timings = self.queries.get((shape, caller))
+            if timings is None:
+                timings = self.queries[(shape, caller)] = Timings()
+            timings.add(seconds, rows)
+        for hook in self.hooks:
+            hook(
+                {
+                    "kind": "query",
+                    "shape": shape,
+                    "caller": caller,
+                    "rows": rows,
+                    "seconds": seconds,
+                }
+            )
+
+    def record_render(self, badge_class_name, seconds):
+        with self._lock:
+            timings = self.renders.get(badge_class_name)
+            if timings is None:
+                timings = self.renders[badge_class_name] = Timings()
+            timings.add(seconds, 1)
+        for hook in self.hooks:
+            hook({"kind": "render", "class": badge_class_name, "seconds": seconds})
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "queries": [
+                    {"shape": shape, "caller": caller, **timings.as_dict()}
+                    for (shape, caller), timings in self.queries.items()
+                ],
+                "renders": [
+                    {"class": name, **timings.as_dict()}
+                    for name, timings in self.renders.items()
+                ],
+            }
+
+    def summary(self):
+        """
+        A plain-text report, slowest groups first.
+        """
+        lines = ["------- QUERIES -------"]
+        # Hold the lock throughout, so the report can't change half way.
+        with self._lock:
+            for (shape, caller), timings in sorted(
+                self.queries.items(), key=lambda item: -item[1].seconds
+            ):
+                lines.append(f"{caller or '?'}: {shape}")
+                lines.append(self._format_timings(timings))
+            lines.append("------- BADGE RENDERING -------")
+            for name, timings in sorted(
+                self.renders.items(), key=lambda item: -item[1].seconds
+            ):
+                lines.append(name)
+                lines.append(self._format_timings(timings))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format_timings(timings):
+        mean = timings.seconds / timings.calls if timings.calls else 0.0
+        labels = [f"<={bound:g}s" for bound in HISTOGRAM_BOUNDS[:-1]]
+        labels.append(f">{HISTOGRAM_BOUNDS[-2]:g}s")
+        buckets = ", ".join(
+            f"{label}: {count}"
+            for label, count in zip(labels, timings.histogram)
+            if count
+        )
+        return (
+            f"    calls {timings.calls}, rows {timings.rows},"
+            f" total {timings.seconds:.4f}s, mean {mean * 1000:.3f}ms [{buckets}]"
+        )
@@ -7,16 +7,104 @@ This class will be the _target_ of our mocking. There are basic
 functions/methods that return a value, and more general queries
 returning iterables of data structures (rows, JSON, etc.)
 
-IMPORTANT: For simplicity in our example, clients access specific
-columns in results by number. If needed we could get the column names
-from the query's `description` attribute.
+Rows come back as `Person` records (see person.py), so columns can be
+read by name. They are still tuples, so for simplicity some clients in
+our example access specific columns by number.
 
 Original Author: edc@mindthump.org
 """
 
 import sqlite3
 import logging
+import os
+import threading
 import time
+import uuid
+from contextlib import nullcontext
+from pathlib import Path
+from people.backends import ENGINES
+from people.cache import QueryCache
+from people.latency import LatencyModel
+from people.metrics import Metrics, find_caller
+from people.person import Person
+
+# The statements behind the basic lookups. `explain_queries()` prints their
+# query plans, so a missing index shows up as a full table "SCAN".
+PERSON_BY_ID_QUERY = "SELECT * FROM people WHERE id = ?"
+ALL_PEOPLE_QUERY = "SELECT * FROM people"
+PEOPLE_BY_TYPE_QUERY = "SELECT * FROM people WHERE type = ?"
+# Keyset pagination: each page starts right after the last ID of the one
+# before, so sqlite seeks straight to it (in the primary key, or in the
+# type index, whose entries are ordered by ID within a type) however deep
+# into the roster it is. OFFSET would step over every row before it.
+PEOPLE_PAGE_QUERY = "SELECT * FROM people WHERE id > ? ORDER BY id LIMIT ?"
+PEOPLE_BY_TYPE_PAGE_QUERY = (
+    "SELECT * FROM people WHERE type = ? AND id > ? ORDER BY id LIMIT ?"
+)
+
+
+# Rows per page when nobody says otherwise.
+DEFAULT_PAGE_SIZE = 1000
+# The smallest ID sqlite can store: "after" it means from the beginning.
+_BEFORE_FIRST_ID = -(2**63)
+
+# Insert a person, or update them if the ID is taken. Rows that wouldn't
+# actually change are left alone, so they don't count as changed.
+UPSERT_PERSON = (
+    "INSERT INTO people (id, name, title, type) VALUES (?, ?, ?, ?)"
+    " ON CONFLICT(id) DO UPDATE"
+    " SET name = excluded.name, title = excluded.title, type = excluded.type"
+    " WHERE (name, title, type) IS NOT (excluded.name, excluded.title, excluded.type)"
+)
+
+# Bump this and add a step to `PeopleData.migrate()` whenever the schema
+# changes. The version lives in the database itself (`PRAGMA user_version`);
+# version 0 is the original table with no key or index.
+SCHEMA_VERSION = 3
+
+# Logs an update as a change to NEW.id. An update that changes the ID
+# itself also logs the OLD.id as deleted, or a badge would be left behind
+# under it. (Version 3; version 2 only logged NEW.id.)
+PEOPLE_UPDATED_TRIGGER = (
+    "CREATE TRIGGER people_updated AFTER UPDATE ON people BEGIN"
+    " INSERT INTO people_changes SELECT OLD.id,"
+    " (SELECT IFNULL(MAX(change), 0) + 1 FROM people_changes), 1"
+    " WHERE OLD.id IS NOT NEW.id"
+    " ON CONFLICT(id) DO UPDATE SET change = excluded.change,"
+    " deleted = excluded.deleted;"
+    " INSERT INTO people_changes VALUES (NEW.id,"
+    " (SELECT IFNULL(MAX(change), 0) + 1 FROM people_changes), 0)"
+    " ON CONFLICT(id) DO UPDATE SET change = excluded.change,"
+    " deleted = excluded.deleted; END"
+)
+
+# Version 2: every insert, update or delete of a person is numbered and
+# logged in `people_changes` (one row per ID: its latest change).
+CHANGE_TRACKING_SCHEMA = [
+    "CREATE TABLE people_changes("
+    "id INTEGER PRIMARY KEY, change INTEGER NOT NULL, deleted INTEGER NOT NULL)",
+    "CREATE INDEX people_changes_change ON people_changes(change)",
+    # Identifies this particular database, so a watermark from another one
+    # (e.g. last run's in-memory database) is never mistaken for ours.
+    "CREATE TABLE people_meta(key TEXT PRIMARY KEY, value TEXT)",
+    # An upsert rather than INSERT OR REPLACE: a trigger's OR REPLACE gives
+    # way to the conflict handling of the statement that fired it.
+    "CREATE TRIGGER people_inserted AFTER INSERT ON people BEGIN"
+    " INSERT INTO people_changes VALUES (NEW.id,"
+    " (SELECT IFNULL(MAX(change), 0) + 1 FROM people_changes), 0)"
+    " ON CONFLICT(id) DO UPDATE SET change = excluded.change,"
+    " deleted = excluded.deleted; END",
+    PEOPLE_UPDATED_TRIGGER,
+    "CREATE TRIGGER people_deleted AFTER DELETE ON people BEGIN"
+    " INSERT INTO people_changes VALUES (OLD.id,"
+    " (SELECT IFNULL(MAX(change), 0) + 1 FROM people_changes), 1)"
+    " ON CONFLICT(id) DO UPDATE SET change = excluded.change,"
+    " deleted = excluded.deleted; END",
+]
+
+# SQLite limits the number of "?" parameters in a single statement (999 on
+# older builds), so bulk lookups are split into chunks of this size.
+MAX_QUERY_PARAMETERS = 500
 
 
 # Data to fill our test database.
@@ -32,25 +120,455 @@ people_test_data = [
 ]
 
 
+def is_id_lookup(query_string):
+    """
+    True for queries that only fetch people by ID (see `QueryCache.put()`).
+    """
+    return query_string == PERSON_BY_ID_QUERY or query_string.startswith(
+        "SELECT * FROM people WHERE id IN ("
+    )
+
+
+class _Connection(object):
+    """
+    Works out which sqlite3 connection `PeopleData.connection` means for the
+    calling thread. Normally that is one connection shared by everybody; after
+    `PeopleData.configure_connections(..., per_thread=True)` each thread
+    lazily opens its own connection to the same database.
+    """
+
+    def __get__(self, instance, owner):
+        if not owner.per_thread_connections:
+            return owner._shared_connection
+        connection = getattr(owner._thread_local, "connection", None)
+        if connection is None:
+            connection = owner._connect(owner.database)
+            owner._thread_local.connection = connection
+            logging.debug("Opened a connection to %s for this thread.", owner.database)
+        return connection
+
+
 class PeopleData(object):
     """ """
 
-    # Class variable; each call to `connect()` for sqlite3 in-memory is a new instance
-    connection = sqlite3.connect(":memory:")
+    # Class variables; each call to `connect()` for sqlite3 in-memory is a new
+    # instance, so by default everybody shares one connection. Other threads
+    # (e.g. the executor behind AsyncPeopleData) may use it too, one at a
+    # time, guarded by `connection_lock`. See `configure_connections()`.
+    database = ":memory:"
+    per_thread_connections = False
+    _shared_connection = sqlite3.connect(database, check_same_thread=False)
+    _thread_local = threading.local()
+    connection = _Connection()
+    connection_lock = threading.Lock()
+    # What each trip to the database "costs"; see latency.py.
+    latency = LatencyModel(fixed=2)
+    # Opt-in instrumentation; see `enable_metrics()`.
+    metrics = None
+    # Opt-in request coalescing for ID lookups; see `enable_loader()`.
+    loader = None
+    # Rows pulled from the cursor at a time by the streaming `iter_*` methods.
+    fetch_batch_size = 1000
+    # Opt-in read-through cache shared by all instances; see `enable_cache()`.
+    cache = None
+    # Every ID in the database, so impossible lookups can fail without a
+    # round trip. None means "not known yet", and then nothing is filtered.
+    known_ids = None
+    # IDs recently looked up and not found: {id: expiry time}. Covers the
+    # case where the database changed behind our back.
+    negative_cache_ttl = 5.0
+    _missing_ids = {}
+    # The engine answering lookups instead of sqlite, or None for sqlite
+    # itself; see `use_backend()` and backends.py.
+    backend = None
+    # Bytes of the database file each connection may memory-map (sqlite's
+    # `mmap_size`). Only set for a snapshot opened by
+    # `restore_snapshot(..., read_only=True)`; `configure_connections()`
+    # resets it for any other database.
+    mmap_size = 0
+
+    @classmethod
+    def initialize_data(cls, only_if_empty=False):
+        """
+        Fill the database with data from the list of tuples above, bringing
+        the schema up to date first. Safe to call on a database that already
+        has the data. With `only_if_empty`, a database that already has
+        anybody in it (e.g. a real roster in a file) is left as it is.
+        """
+        cls.migrate()
+        if not (
+            only_if_empty
+            and cls.connection.execute("SELECT 1 FROM people LIMIT 1").fetchone()
+        ):
+            cls.connection.executemany(UPSERT_PERSON, people_test_data)
+            cls.connection.commit()
+        cls._load_known_ids()
+        cls.forget_cached_rows()
+        cls.refresh_backend()
+        logging.debug("Database initialized.")
+
+    @classmethod
+    def _load_known_ids(cls):
+        known_id_rows = cls.connection.execute("SELECT id FROM people")
+        cls.known_ids = {row[0] for row in known_id_rows}
+        cls._missing_ids = {}
+
+    @classmethod
+    def save_snapshot(cls, path):
+        """
+        Save the database, schema, indexes and all, as a snapshot file for
+        `restore_snapshot()`. The file is replaced in one step, so a run
+        starting at the same moment sees either the old snapshot or the new.
+        """
+        temporary_path = f"{path}.tmp"
+        cls.save_to_file(temporary_path)
+        os.replace(temporary_path, path)
+        logging.debug("Saved a snapshot to %s.", path)
+
+    @classmethod
+    def restore_snapshot(cls, path, read_only=False):
+        """
+        Start from a prebuilt database instead of `initialize_data()`.
+
+        By default sqlite's backup API copies the file's pages into the
+        current connection, which is much quicker than rebuilding the table
+        and its indexes row by row. With `read_only`, PeopleData opens the
+        file itself, read-only and memory-mapped, so nothing is copied at
+        all; writes (`insert_people()`, `load_people()`, ...) then fail.
+
+        Returns False, leaving everything as it was, if `path` doesn't
+        exist or holds an older schema; the caller should build the data
+        the slow way and `save_snapshot()` it. Anything else at `path` (a
+        file that isn't a database, or a newer schema) raises
+        `DatabaseError` rather than being taken for a missing snapshot,
+        since the caller would then write over it.
+        """
+        if not os.path.exists(path):
+            logging.debug("No snapshot at %s yet.", path)
+            return False
+        uri = f"{Path(path).resolve().as_uri()}?mode=ro"
+        snapshot = None
+        try:
+            snapshot = sqlite3.connect(uri, uri=True)
+            version = snapshot.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                logging.debug("Snapshot %s is schema version %d.", path, version)
+                return False
+            if version > SCHEMA_VERSION:
+                raise sqlite3.DatabaseError(
+                    f"Snapshot {path} is schema version {version}, newer than"
+                    f" this program's {SCHEMA_VERSION}"
+                )
+            if read_only:
+                cls.configure_connections(
+                    uri,
+                    per_thread=cls.per_thread_connections,
+                    mmap_size=os.path.getsize(path),
+                )
+            else:
+                snapshot.backup(cls.connection)
+        finally:
+            if snapshot is not None:
+                snapshot.close()
+        # Reading every ID would make startup grow with the roster again;
+        # without them lookups just aren't pre-filtered (see `known_ids`).
+        cls.known_ids = None
+        cls._missing_ids = {}
+        cls.forget_cached_rows()
+        cls.refresh_backend()
+        logging.debug("Restored the snapshot %s.", path)
+        return True
+
+    @classmethod
+    def migrate(cls):
+        """
+        Create the schema, or upgrade an older one, to SCHEMA_VERSION.
+
+        Version 1 makes `id` an INTEGER PRIMARY KEY (an alias for sqlite's
+        rowid, so looking up an ID is a b-tree search rather than a scan)
+        and indexes `type` for the section queries. Version 2 adds change
+        tracking (see CHANGE_TRACKING_SCHEMA), and version 3 has it notice
+        a person's ID changing (see PEOPLE_UPDATED_TRIGGER).
+        """
+        connection = cls.connection
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        has_table = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'people'"
+        ).fetchone()
+        with connection:
+            # sqlite3 only begins a transaction by itself before an INSERT,
+            # UPDATE or DELETE, so the RENAME and CREATE below would commit
+            # on their own. Begin one now, so that if anything fails the
+            # whole upgrade rolls back and the old table is left as it was.
+            if not connection.in_transaction:
+                connection.execute("BEGIN")
+            if version < 1:
+                if has_table:
+                    # Version 0: sqlite can't add a primary key to an existing
+                    # table, so copy the rows into a new one. If the old table
+                    # holds an ID twice, the last copy wins.
+                    connection.execute("ALTER TABLE people RENAME TO people_v0")
+                connection.execute(
+                    "CREATE TABLE people("
+                    "id INTEGER PRIMARY KEY, name TEXT, title TEXT, type TEXT)"
+                )
+                if has_table:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO people (id, name, title, type)"
+                        " SELECT id, name, title, type FROM people_v0 ORDER BY rowid"
+                    )
+                    connection.execute("DROP TABLE people_v0")
+                connection.execute("CREATE INDEX people_type ON people(type)")
+            if version < 2:
+                for statement in CHANGE_TRACKING_SCHEMA:
+                    connection.execute(statement)
+                # Everybody already here counts as change number 1.
+                connection.execute(
+                    "INSERT INTO people_changes SELECT id, 1, 0 FROM people"
+                )
+                connection.execute(
+                    "INSERT INTO people_meta VALUES ('database_id', ?)",
+                    [uuid.uuid4().hex],
+                )
+            elif version < 3:
+                connection.execute("DROP TRIGGER people_updated")
+                connection.execute(PEOPLE_UPDATED_TRIGGER)
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        logging.debug("Migrated schema from version %d to %d.", version, SCHEMA_VERSION)
+
+    @classmethod
+    def database_id(cls):
+        return cls.connection.execute(
+            "SELECT value FROM people_meta WHERE key = 'database_id'"
+        ).fetchone()[0]
 
     @classmethod
-    def initialize_data(cls):
+    def current_change(cls):
         """
-        Fill the database with data from the list of tuples above.
+        The number of the latest change to `people`: a watermark to hand to
+        `changes_since()` later on.
         """
-        cls.connection.execute(
-            "CREATE TABLE people(id INT, name TEXT, title TEXT, type TEXT)"
+        return cls.connection.execute(
+            "SELECT IFNULL(MAX(change), 0) FROM people_changes"
+        ).fetchone()[0]
+
+    @classmethod
+    def changes_since(cls, watermark):
+        """
+        [(id, deleted)] for everybody inserted, updated or deleted after the
+        `watermark` change.
+        """
+        return cls.connection.execute(
+            "SELECT id, deleted FROM people_changes WHERE change > ? ORDER BY change",
+            [watermark],
+        ).fetchall()
+
+    @classmethod
+    def explain_query_plan(cls, query_string, parameters=None):
+        """
+        Return sqlite's plan for a statement, one line per step, e.g.
+        "SEARCH people USING INTEGER PRIMARY KEY (rowid=?)".
+        """
+        plan = cls.connection.execute(
+            f"EXPLAIN QUERY PLAN {query_string}", parameters or ()
+        )
+        return [row[3] for row in plan]
+
+    @classmethod
+    def explain_queries(cls):
+        """
+        The plans of the basic lookups, as {statement: [plan lines]}.
+        """
+        statements = [
+            (PERSON_BY_ID_QUERY, [1]),
+            ("SELECT * FROM people WHERE id IN (?, ?)", [1, 2]),
+            (ALL_PEOPLE_QUERY, None),
+            (PEOPLE_BY_TYPE_QUERY, ["STUDENT"]),
+            (PEOPLE_PAGE_QUERY, [1, DEFAULT_PAGE_SIZE]),
+            (PEOPLE_BY_TYPE_PAGE_QUERY, ["STUDENT", 1, DEFAULT_PAGE_SIZE]),
+        ]
+        return {
+            query_string: cls.explain_query_plan(query_string, parameters)
+            for query_string, parameters in statements
+        }
+
+    @classmethod
+    def configure_connections(cls, database, per_thread=True, mmap_size=0):
+        """
+        Point PeopleData at `database` (a file name or a sqlite URI). With
+        `per_thread`, every thread gets its own connection; for an in-memory
+        database they can only see the same data through a shared cache, e.g.
+        "file:people?mode=memory&cache=shared".
+
+        The connection opened here stays open for the life of the process;
+        it is the main thread's connection, and it keeps a shared in-memory
+        database alive.
+
+        `mmap_size` is how many bytes of the database file each connection
+        may memory-map; it applies to this database only.
+        """
+        cls.database = database
+        cls.per_thread_connections = per_thread
+        cls.mmap_size = mmap_size
+        cls._shared_connection = cls._connect(database)
+        cls._thread_local = threading.local()
+        cls._thread_local.connection = cls._shared_connection
+
+    @classmethod
+    def _connect(cls, database):
+        connection = sqlite3.connect(database, uri=True, check_same_thread=False)
+        if cls.mmap_size:
+            connection.execute(f"PRAGMA mmap_size = {cls.mmap_size}")
+        return connection
+
+    @classmethod
+    def insert_people(cls, rows):
+        """
+        Add (id, name, title, type) rows, keeping the known IDs current.
+        """
+        rows = list(rows)
+        cls.connection.executemany(
+            "INSERT INTO people (id, name, title, type) VALUES (?, ?, ?, ?)", rows
         )
+        cls.connection.commit()
+        if cls.backend is not None:
+            cls.backend.upsert(rows)
+        for row in rows:
+            if cls.known_ids is not None:
+                cls.known_ids.add(row[0])
+            cls._missing_ids.pop(row[0], None)
+            if cls.cache is not None:
+                cls.cache.invalidate(row[0])
+            if cls.loader is not None:
+                cls.loader.clear(row[0])
+        logging.debug("Inserted %d people.", len(rows))
+
+    @classmethod
+    def delete_people(cls, ids):
+        ids = list(ids)
         cls.connection.executemany(
-            "INSERT INTO people (id, name, title, type) VALUES (?, ?, ?, ?)",
-            people_test_data,
+            "DELETE FROM people WHERE id = ?", [(_id,) for _id in ids]
         )
-        logging.debug("Database initialized.")
+        cls.connection.commit()
+        if cls.backend is not None:
+            cls.backend.delete(ids)
+        for _id in ids:
+            if cls.known_ids is not None:
+                cls.known_ids.discard(_id)
+            if cls.cache is not None:
+                cls.cache.invalidate(_id)
+            if cls.loader is not None:
+                cls.loader.clear(_id)
+        logging.debug("Deleted %d people.", len(ids))
+
+    @classmethod
+    def _is_known_missing(cls, query_id):
+        """
+        True when `query_id` certainly isn't in the database: it is not one
+        of the known IDs, or it missed recently enough to trust the miss.
+        Only integers are checked: sqlite turns "6" into 6 (the column's
+        INTEGER affinity), so an ID given as a string goes to the query.
+        """
+        if type(query_id) is not int:
+            return False
+        if cls.known_ids is not None and query_id not in cls.known_ids:
+            return True
+        expires_at = cls._missing_ids.get(query_id)
+        if expires_at is None:
+            return False
+        if expires_at > time.monotonic():
+            return True
+        # Another thread may have dropped it already.
+        cls._missing_ids.pop(query_id, None)
+        return False
+
+    @classmethod
+    def _remember_missing(cls, query_id):
+        cls._missing_ids[query_id] = time.monotonic() + cls.negative_cache_ttl
+
+    @classmethod
+    def use_backend(cls, name):
+        """
+        Answer lookups from the engine called `name` in backends.ENGINES,
+        filled with a copy of the database, or from sqlite again ("sqlite").
+        Writes made through PeopleData (and `load_people()`) keep the copy
+        current.
+        """
+        if name == "sqlite":
+            cls.backend = None
+            return None
+        if name not in ENGINES:
+            raise ValueError(f"Unknown backend: '{name}'")
+        if type(cls.backend) is not ENGINES[name]:
+            cls.backend = ENGINES[name].from_connection(cls.connection)
+        return cls.backend
+
+    @classmethod
+    def refresh_backend(cls):
+        """
+        Copy the database into the engine again, after a bulk change.
+        """
+        if cls.backend is not None:
+            cls.backend = type(cls.backend).from_connection(cls.connection)
+
+    @classmethod
+    def forget_cached_rows(cls):
+        """
+        Empty the result cache and the loader's rows, after a bulk change
+        that bypassed `insert_people()` and `delete_people()`.
+        """
+        if cls.cache is not None:
+            cls.cache.clear()
+        if cls.loader is not None:
+            cls.loader.clear()
+
+    @classmethod
+    def enable_cache(cls, max_size=1024, ttl=300.0):
+        """
+        Start caching query results. Repeated lookups are then answered
+        from memory instead of paying for another trip to the database.
+        """
+        cls.cache = QueryCache(max_size=max_size, ttl=ttl)
+        return cls.cache
+
+    @classmethod
+    def disable_cache(cls):
+        cls.cache = None
+
+    @classmethod
+    def enable_metrics(cls):
+        """
+        Start recording query counts, rows and timings (see metrics.py).
+        """
+        cls.metrics = Metrics()
+        return cls.metrics
+
+    @classmethod
+    def disable_metrics(cls):
+        cls.metrics = None
+
+    @classmethod
+    def enable_loader(cls, window=0.002, cache=True, max_batch_size=None):
+        """
+        Route `get_person_by_id()` (and the name and title lookups built on
+        it) through a PersonLoader, which batches the IDs asked for at
+        about the same time into one query (see dataloader.py).
+        """
+        # Imported here because dataloader.py builds on this module.
+        from people.dataloader import PersonLoader
+
+        cls.loader = PersonLoader(
+            window=window,
+            max_batch_size=max_batch_size or MAX_QUERY_PARAMETERS,
+            cache=cache,
+        )
+        return cls.loader
+
+    @classmethod
+    def disable_loader(cls):
+        cls.loader = None
 
     def _query(self, query_string, parameters=None):
         """
@@ -58,13 +576,52 @@ class PeopleData(object):
         do some logging, and sit around doing nothing for a short time to represent an
         "expensive" resource.
         """
+        if self.metrics is None:
+            return self._cached_query(query_string, parameters)
+        started = time.perf_counter()
+        row_count = 0
+        try:
+            result = self._cached_query(query_string, parameters)
+            row_count = len(result)
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            caller = find_caller(self)
+            self.metrics.record_query(query_string, caller, row_count, seconds)
+
+    def _cached_query(self, query_string, parameters=None):
+        if self.cache is not None:
+            cache_key = self.cache.make_key(query_string, parameters)
+            cached_result = self.cache.get(cache_key)
+            if cached_result is not None:
+                logging.debug("Cache hit, returning cached results.")
+                return cached_result
         # Wait a while here to show "cost" ;)
-        time.sleep(2)
-        if parameters:
-            raw_query_cursor = self.connection.execute(query_string, parameters)
-        else:
-            raw_query_cursor = self.connection.execute(query_string)
-        result = raw_query_cursor.fetchall()
+        time.sleep(self.latency.query_cost())
+        result = self._execute(query_string, parameters)
+        if self.latency.per_row:
+            time.sleep(self.latency.rows_cost(len(result)))
+        if self.cache is not None:
+            self.cache.put(cache_key, result, by_id=is_id_lookup(query_string))
+        logging.debug("Completed query, returning results.")
+        return result
+
+    def _execute(self, query_string, parameters=None):
+        """
+        The part of `_query()` that actually talks to sqlite, without the
+        waiting around, so it can also be run on another thread.
+        """
+        # Only a connection shared between threads needs to be taken in turns.
+        lock = nullcontext() if self.per_thread_connections else self.connection_lock
+        with lock:
+            raw_query_cursor = self.connection.cursor()
+            # Rows come back as Person records rather than plain tuples.
+            raw_query_cursor.row_factory = Person.row_factory
+            if parameters:
+                raw_query_cursor.execute(query_string, parameters)
+            else:
+                raw_query_cursor.execute(query_string)
+            result = raw_query_cursor.fetchall()
         # We're raising this error on purpose, to investigate `pytest.raises()`
         if not result:
             raise self.connection.DataError(
@@ -72,9 +629,72 @@ class PeopleData(object):
                     query_string
                 )
             )
-        logging.debug("Completed query, returning results.")
         return result
 
+    def _iter_query(self, query_string, parameters=None, batch_size=None):
+        """
+        The streaming version of `_query()`: yields rows as they come off the
+        cursor, `batch_size` at a time, instead of building one big list.
+        Pays the same cost up front and raises the same `DataError` when
+        there are no rows at all. Results are not cached.
+        """
+        batches = self._iter_batches(query_string, parameters, batch_size)
+        if self.metrics is None:
+            return (row for rows in batches for row in rows)
+        return self._measured_rows(batches, query_string, find_caller(self))
+
+    def _measured_rows(self, batches, query_string, caller):
+        """
+        Pass the rows in `batches` through, recording the query once the
+        stream is used up. Only the time spent getting each batch counts,
+        not whatever the consumer does with the rows in between.
+        """
+        seconds = 0.0
+        row_count = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    rows = next(batches)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - started
+                row_count += len(rows)
+                yield from rows
+        finally:
+            self.metrics.record_query(query_string, caller, row_count, seconds)
+
+    def _iter_batches(self, query_string, parameters=None, batch_size=None):
+        """
+        Lists of up to `batch_size` rows, straight off the cursor.
+        """
+        batch_size = batch_size or self.fetch_batch_size
+        # Wait a while here to show "cost" ;)
+        time.sleep(self.latency.query_cost())
+        lock = nullcontext() if self.per_thread_connections else self.connection_lock
+        with lock:
+            raw_query_cursor = self.connection.cursor()
+            raw_query_cursor.row_factory = Person.row_factory
+            raw_query_cursor.execute(query_string, parameters or ())
+            rows = raw_query_cursor.fetchmany(batch_size)
+        if not rows:
+            raise self.connection.DataError(
+                "No matching results found in database for query: '{}'".format(
+                    query_string
+                )
+            )
+        row_count = 0
+        while rows:
+            row_count += len(rows)
+            if self.latency.per_row:
+                time.sleep(self.latency.rows_cost(len(rows)))
+            yield rows
+            # Don't hold the lock while the caller works through the batch.
+            with lock:
+                rows = raw_query_cursor.fetchmany(batch_size)
+        logging.debug("Completed streaming query, yielded %d rows.", row_count)
+
     # TODO: Call this on object initialization?
     def get_person_by_id(self, query_id):
         """
@@ -82,8 +702,20 @@ class PeopleData(object):
         special here to accommodate tests, it's just ordinary code; that
         is the true beauty of the mocking techniques.
         """
-        result = self._query("SELECT * FROM people WHERE id = ?", [query_id])
-        logging.debug(f"Completed get_person_by_id: {result}.")
+        if self.backend is not None:
+            return self.backend.get_person_by_id(query_id)
+        if self._is_known_missing(query_id):
+            raise self.connection.DataError(
+                f"No person with ID {query_id} in database (rejected without a query)."
+            )
+        if self.loader is not None:
+            return self.loader.load(query_id)
+        try:
+            result = self._query(PERSON_BY_ID_QUERY, [query_id])
+        except self.connection.DataError:
+            self._remember_missing(query_id)
+            raise
+        logging.debug("Completed get_person_by_id: %s.", result)
         # There should be :) only one record.
         return result[0]
 
@@ -93,22 +725,195 @@ class PeopleData(object):
         A utility method to extract one field.
         """
         result = self.get_person_by_id(query_id)[1]
-        logging.debug(f"Completed get_name_by_id: {query_id} => {result}.")
+        logging.debug("Completed get_name_by_id: %s => %s.", query_id, result)
         return result
 
     def get_title_by_id(self, query_id):
         result = self.get_person_by_id(query_id)[2]
-        logging.debug(f"Completed get_title_by_id: {query_id} => {result}.")
+        logging.debug("Completed get_title_by_id: %s => %s.", query_id, result)
+        return result
+
+    def get_people_by_ids(self, query_ids):
+        """
+        Fetch many people with one `IN (...)` query instead of one
+        round trip per ID. Rows come back in the order of `query_ids`;
+        duplicate IDs are only fetched once, and IDs that are not in the
+        database are simply left out. (If none of them are found, it raises
+        `DataError` like every other lookup.)
+        """
+        if self.backend is not None:
+            return self.backend.get_people_by_ids(query_ids)
+        requested_ids = list(dict.fromkeys(query_ids))
+        # Don't spend query parameters on IDs we already know aren't there.
+        unique_ids = [_id for _id in requested_ids if not self._is_known_missing(_id)]
+        rows_by_id = {}
+        for start in range(0, len(unique_ids), MAX_QUERY_PARAMETERS):
+            chunk = unique_ids[start : start + MAX_QUERY_PARAMETERS]
+            placeholders = ", ".join("?" * len(chunk))
+            try:
+                rows = self._query(
+                    f"SELECT * FROM people WHERE id IN ({placeholders})", chunk
+                )
+            except self.connection.DataError:
+                # A chunk with no matches is fine as long as another one hits.
+                continue
+            for row in rows:
+                rows_by_id[row[0]] = row
+        for _id in unique_ids:
+            if _id not in rows_by_id:
+                self._remember_missing(_id)
+        if not rows_by_id:
+            raise self.connection.DataError(
+                f"No matching results found in database for IDs: {requested_ids}"
+            )
+        result = [rows_by_id[_id] for _id in unique_ids if _id in rows_by_id]
+        logging.debug(
+            "Completed get_people_by_ids for %d IDs, returned %d rows.",
+            len(unique_ids),
+            len(result),
+        )
         return result
 
     def get_all_people(self):
-        result = self._query("SELECT * FROM people")
-        logging.debug(f"Completed get_all_people, returned {len(result)} rows.")
+        if self.backend is not None:
+            return self.backend.get_all_people()
+        result = self._query(ALL_PEOPLE_QUERY)
+        logging.debug("Completed get_all_people, returned %d rows.", len(result))
         return result
 
+    def get_all_people_page(self, after_id=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        One page of everybody, in ID order: up to `page_size` people whose
+        IDs come after `after_id` (None for the first page). Returns
+        (people, token); pass the token back as `after_id` for the next
+        page. The token is None once there are no more pages, and a page
+        past the end is simply empty rather than a `DataError`.
+
+        The token is just the last ID handed out, so a walk through the
+        roster can be stopped and picked up again later, even by another
+        process, and it carries on correctly if people are added or
+        removed in between.
+        """
+        if self.backend is not None:
+            return self.backend.get_all_people_page(after_id, page_size)
+        return self._page(PEOPLE_PAGE_QUERY, [], after_id, page_size)
+
+    def get_people_by_type_page(
+        self, query_type, after_id=None, page_size=DEFAULT_PAGE_SIZE
+    ):
+        """
+        `get_all_people_page()` for the people of one type.
+        """
+        if self.backend is not None:
+            return self.backend.get_people_by_type_page(query_type, after_id, page_size)
+        return self._page(PEOPLE_BY_TYPE_PAGE_QUERY, [query_type], after_id, page_size)
+
+    def _page(self, query_string, parameters, after_id, page_size):
+        if after_id is None:
+            after_id = _BEFORE_FIRST_ID
+        try:
+            people = self._query(query_string, parameters + [after_id, page_size])
+        except self.connection.DataError:
+            return [], None
+        # A short page is the last one; a full one may or may not be.
+        token = people[-1].id if len(people) == page_size else None
+        logging.debug(
+            "Completed page after ID %d, returned %d rows.", after_id, len(people)
+        )
+        return people, token
+
+    def iter_all_people(self, batch_size=None):
+        if self.backend is not None:
+            return self.backend.iter_all_people(batch_size)
+        return self._iter_query(ALL_PEOPLE_QUERY, batch_size=batch_size)
+
+    def iter_people_by_type(self, query_type, batch_size=None):
+        if self.backend is not None:
+            return self.backend.iter_people_by_type(query_type, batch_size)
+        return self._iter_query(
+            PEOPLE_BY_TYPE_QUERY, [query_type], batch_size=batch_size
+        )
+
+    def iter_people_grouped_by_type(
+        self, query_types, batch_size=None, first_id=None, last_id=None
+    ):
+        """
+        Everyone whose type is in `query_types`, in one query (one round
+        trip), grouped by type in the order the types are given. Within a
+        group people are in ID order. `first_id` and
+        `last_id` limit it to one range of IDs (both ends included).
+        """
+        query_types = list(query_types)
+        if self.backend is not None:
+            return self.backend.iter_people_grouped_by_type(
+                query_types, batch_size, first_id, last_id
+            )
+        # One SELECT per type, glued together with UNION ALL: each one walks
+        # the type index, which is already in ID order within a type, and
+        # sqlite runs them in the order written. So the rows come out
+        # grouped without sorting anything first, and the first badge can
+        # print as soon as its row is read. (A type listed twice still only
+        # comes out once, as with `type IN (...)`.)
+        query_types = list(dict.fromkeys(query_types))
+        select = "SELECT * FROM people WHERE type = ?"
+        id_parameters = []
+        if first_id is not None and last_id is not None:
+            select += " AND id BETWEEN ? AND ?"
+            id_parameters = [first_id, last_id]
+        parameters = []
+        for query_type in query_types:
+            parameters += [query_type] + id_parameters
+        # No types at all matches nobody, like an empty `type IN ()`.
+        query_string = " UNION ALL ".join([select] * len(query_types))
+        return self._iter_query(
+            query_string or "SELECT * FROM people WHERE 0",
+            parameters,
+            batch_size=batch_size,
+        )
+
+    @classmethod
+    def shard_id_ranges(cls, shard_count):
+        """
+        Split the IDs into up to `shard_count` (first, last) ranges holding
+        about the same number of people each, in ID order.
+        """
+        connection = cls.connection
+        people_count = connection.execute("SELECT COUNT(*) FROM people").fetchone()[0]
+        if not people_count:
+            return []
+        # The ID at the start of each shard; walking the primary key to an
+        # offset is cheap, and we only do it once per shard.
+        starts = []
+        for shard in range(shard_count):
+            offset = shard * people_count // shard_count
+            start = connection.execute(
+                "SELECT id FROM people ORDER BY id LIMIT 1 OFFSET ?", [offset]
+            ).fetchone()[0]
+            if not starts or start > starts[-1]:
+                starts.append(start)
+        last_id = connection.execute("SELECT MAX(id) FROM people").fetchone()[0]
+        ends = [start - 1 for start in starts[1:]] + [last_id]
+        return list(zip(starts, ends))
+
+    @classmethod
+    def save_to_file(cls, path):
+        """
+        Copy the whole database into the sqlite file `path` (sqlite's online
+        backup, so it works for in-memory databases too).
+        """
+        target = sqlite3.connect(path)
+        try:
+            cls.connection.backup(target)
+        finally:
+            target.close()
+
     def get_people_by_type(self, query_type):
-        result = self._query("SELECT * FROM people WHERE type = ?", [query_type])
+        if self.backend is not None:
+            return self.backend.get_people_by_type(query_type)
+        result = self._query(PEOPLE_BY_TYPE_QUERY, [query_type])
         logging.debug(
-            f"Completed get_people_by_type for '{query_type}', returned {len(result)} rows."
+            "Completed get_people_by_type for '%s', returned %d rows.",
+            query_type,
+            len(result),
         )
         return result
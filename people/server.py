@@ -0,0 +1,117 @@
+"""
+Serve badges over HTTP on localhost, from a process that stays up.
+
+Starting badges.py means building the database and paying for every
+lookup cold. `badges.py --serve PORT` does that once and then answers
+requests from the same, warm PeopleData (with its cache switched on, or
+an in-memory backend), so a badge takes milliseconds instead of seconds:
+
+    GET /badge/6                 {"id": 6, "type": "EMPLOYEE", "badge": "..."}
+    GET /badges?ids=6,2,99       {"badges": [...], "missing": [99]}
+    GET /section/VOLUNTEER       {"type": "VOLUNTEER", "badges": [...]}
+
+An unknown ID or type is a 404 with {"error": "..."}. Every request is
+handled on its own thread, and connections are kept alive, so a client
+can send request after request without reconnecting. See client.py.
+"""
+
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from people.people_data import PeopleData
+
+
+class BadgeServer(ThreadingHTTPServer):
+    # Don't let a request in progress keep the process alive at shutdown.
+    daemon_threads = True
+
+    def __init__(self, address, badge_classes, people_data=None):
+        super().__init__(address, BadgeRequestHandler)
+        # {person type: badge class}, for the types we serve.
+        self.badge_classes = badge_classes
+        self.people_data = people_data or PeopleData()
+
+    def render(self, person):
+        badge_class = self.badge_classes[person.type]
+        return {
+            "id": person.id,
+            "type": person.type,
+            "badge": badge_class.get_badge_text_from_row(person),
+        }
+
+    def badge(self, _id):
+        person = self.people_data.get_person_by_id(_id)
+        if person.type not in self.badge_classes:
+            raise LookupError(f"No badge for ID {_id}")
+        return self.render(person)
+
+    def badges(self, ids):
+        try:
+            people = self.people_data.get_people_by_ids(ids)
+        except PeopleData.connection.DataError:
+            people = []
+        found = {
+            person.id: self.render(person)
+            for person in people
+            if person.type in self.badge_classes
+        }
+        return {
+            "badges": list(found.values()),
+            "missing": [_id for _id in dict.fromkeys(ids) if _id not in found],
+        }
+
+    def section(self, person_type):
+        if person_type not in self.badge_classes:
+            raise LookupError(f"Unknown person type: '{person_type}'")
+        try:
+            people = self.people_data.get_people_by_type(person_type)
+        except PeopleData.connection.DataError:
+            # Nobody of that type (yet); not an error for a whole section.
+            people = []
+        return {
+            "type": person_type,
+            "badges": [self.render(person) for person in people],
+        }
+
+
+class BadgeRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, so clients can keep the connection open between requests.
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle's algorithm on
+    # the body would wait ~40 ms for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        try:
+            if len(parts) == 2 and parts[0] == "badge":
+                body = self.server.badge(int(parts[1]))
+            elif parts == ["badges"]:
+                ids = parse_qs(url.query).get("ids", [""])[0]
+                body = self.server.badges([int(_id) for _id in ids.split(",") if _id])
+            elif len(parts) == 2 and parts[0] == "section":
+                body = self.server.section(parts[1].upper())
+            else:
+                self.send_json(404, {"error": f"No such endpoint: {url.path}"})
+                return
+        except ValueError as error:
+            self.send_json(400, {"error": str(error)})
+        except (LookupError, PeopleData.connection.DataError) as error:
+            self.send_json(404, {"error": str(error)})
+        else:
+            self.send_json(200, body)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Into our log (at debug level), rather than one line per request
+        # on standard error.
+        logging.debug("%s - " + format, self.address_string(), *args)
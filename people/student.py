@@ -23,6 +23,14 @@ class Student(object):
         # Get the name from each instance of the data source
         student_name = people_data.get_name_by_id(self.student_id)
         student_title = people_data.get_title_by_id(self.student_id)
-        logging.debug(f"name: {student_name}, title: {student_title}")
+        logging.debug("name: %s, title: %s", student_name, student_title)
 
         return f"HI! My name is {student_name} ({student_title})"
+
+    @classmethod
+    def get_badge_text_from_row(cls, row):
+        """
+        Render the badge from a row someone else already fetched (e.g. from
+        `get_people_by_type()` or `get_people_by_ids()`), with no lookups.
+        """
+        return f"HI! My name is {row[1]} ({row[2]})"
@@ -1,6 +1,8 @@
 from __future__ import print_function
 from pathlib import Path
+import atexit
 import os
+import queue
 import logging
 import logging.handlers
 
@@ -8,6 +10,9 @@ import logging.handlers
 General utilities, particularly logging
 """
 
+# Where the people modules live; see `DeferredQueueHandler`.
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
 
 def initialize_logging(
     log_name=None,
@@ -16,11 +21,16 @@ def initialize_logging(
     ci_log_name=os.environ.get("CI_LOG_NAME", "common.log"),
     logging_directory=os.environ.get("WORKSPACE", "."),
     verbose=False,
+    queued=False,
 ):
     """
     This implementation is in-between using the basic logging
     configuration and a fully custom system.
 
+    With `queued`, logging calls only put the record on a queue; a
+    background thread (a QueueListener) does the formatting and the file
+    and console writes, so the code doing the logging never waits on I/O.
+
     IMPORTANT:
     For each Python session, this function should be called first and only once.
     """
@@ -85,6 +95,21 @@ def initialize_logging(
     console_handler.setFormatter(console_formatter)
     logger.addHandler(console_handler)
 
+    # Stop the listener from an earlier call, if any, so it can't write twice.
+    stop_queued_logging()
+    if queued:
+        # Move the real handlers behind a queue. The listener thread sends
+        # each record to them, and still honors each handler's own level.
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            log_queue, file_handler, console_handler, respect_handler_level=True
+        )
+        logger.handlers = [DeferredQueueHandler(log_queue)]
+        listener.start()
+        logging.queue_listener = listener
+        # Flush whatever is still queued when the program ends.
+        atexit.register(stop_queued_logging)
+
     # Save some values so they're easy to get to. First, a Path object...
     # NOTE: str(logging.log_file_path.parent)
     # is the best practice to get the absolute logging directory.
@@ -94,3 +119,41 @@ def initialize_logging(
     # Return the new logger instance -- only useful for a named logger,
     # otherwise "import logging" will always work.
     return logger
+
+
+def stop_queued_logging():
+    """
+    Write out everything still queued and stop the listener thread started
+    by `initialize_logging(queued=True)`. Safe to call more than once.
+    """
+    listener = getattr(logging, "queue_listener", None)
+    if listener is not None:
+        logging.queue_listener = None
+        listener.stop()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    The standard QueueHandler formats the message (e.g. "%s" % rows) before
+    queueing it, in the thread that is logging. The people package never
+    changes its log arguments after the call, so its records can be passed
+    along as-is and formatted by the listener thread. Anybody else's
+    arguments might be mutable, so their records (and any record carrying
+    an exception, whose traceback has to be rendered while it still holds)
+    get the standard treatment.
+    """
+
+    def prepare(self, record):
+        if record.exc_info or record.stack_info or not self.is_deferrable(record):
+            return super().prepare(record)
+        return record
+
+    @staticmethod
+    def is_deferrable(record):
+        """
+        True for a record from a `people` logger, or logged (through the
+        root logger, as this project does) from a module of the package.
+        """
+        if record.name == "people" or record.name.startswith("people."):
+            return True
+        return os.path.dirname(os.path.abspath(record.pathname)) == PACKAGE_DIRECTORY
@@ -26,3 +26,10 @@ class Volunteer(object):
         volunteer_title = people_data.get_title_by_id(_id)
         volunteer_name = people_data.get_name_by_id(_id)
         return f"** {volunteer_name} ({volunteer_title}) **"
+
+    @classmethod
+    def get_badge_text_from_row(cls, row):
+        """
+        Render the badge from an already-fetched row; no data source needed.
+        """
+        return f"** {row[1]} ({row[2]}) **"
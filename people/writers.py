@@ -0,0 +1,137 @@
+"""
+Output formats for badges.
+
+`print()` once per badge means one small write per line. These writers
+push everything through one large buffer instead (1 MiB by default), so
+a big run turns into a handful of big writes, optionally gzip-compressed,
+to standard output or a file.
+
+    text    the familiar output: section headers, then one badge per line
+    jsonl   one JSON object per badge, with the person's fields
+    csv     a header row, then id, name, title, type and badge per row
+"""
+
+import csv
+import gzip
+import io
+import json
+import sys
+
+BUFFER_SIZE = 1024 * 1024
+
+
+class BadgeWriter(object):
+    """
+    Text output; the other formats override `write_section` and `write_badge`.
+    """
+
+    def __init__(
+        self, path=None, compress=False, buffer_size=BUFFER_SIZE, resume_offset=None
+    ):
+        self._gzip_file = None
+        # Picking up an interrupted run: keep the file up to `resume_offset`
+        # (see `checkpoint()`) and carry on writing from there.
+        self.resuming = resume_offset is not None
+        if self.resuming:
+            if path is None or compress or str(path).endswith(".gz"):
+                raise ValueError("Only an uncompressed file can be resumed")
+            binary = open(path, "r+b")
+            binary.truncate(resume_offset)
+            binary.seek(resume_offset)
+            self._owns_binary = True
+        elif path is None and not hasattr(sys.stdout, "buffer"):
+            # Standard output has been swapped for a text-only stream (e.g.
+            # `contextlib.redirect_stdout(io.StringIO())`): write text to it
+            # directly, as print() would.
+            if compress:
+                raise ValueError("Can't compress to a text-only standard output")
+            self._binary = self._buffer = self._gzip_file = None
+            self.stream = sys.stdout
+            return
+        elif path is None:
+            # Anything already printed has to go out before our own output.
+            sys.stdout.flush()
+            binary = sys.stdout.buffer
+            self._owns_binary = False
+        else:
+            binary = open(path, "wb")
+            self._owns_binary = True
+            compress = compress or str(path).endswith(".gz")
+        self._binary = binary
+        if compress:
+            binary = self._gzip_file = gzip.GzipFile(fileobj=binary, mode="wb")
+        self._buffer = io.BufferedWriter(binary, buffer_size=buffer_size)
+        self.stream = io.TextIOWrapper(self._buffer, encoding="utf-8", newline="\n")
+
+    def write_section(self, person_type, header):
+        self.stream.write(f"------- {header} -------\n")
+
+    def write_badge(self, person, badge_text):
+        self.stream.write(badge_text)
+        self.stream.write("\n")
+
+    def checkpoint(self):
+        """
+        Push everything written so far out to the file, and return the
+        offset to resume from if the run is interrupted after this point.
+        """
+        self.stream.flush()
+        if self._binary is None:
+            return None
+        self._buffer.flush()
+        if self._gzip_file is not None:
+            self._gzip_file.flush()
+        self._binary.flush()
+        return self._binary.tell()
+
+    def close(self):
+        """
+        Flush everything out. Standard output itself is left open.
+        """
+        self.stream.flush()
+        if self._binary is None:
+            return
+        self.stream.detach()
+        self._buffer.flush()
+        # Detach rather than close, or closing would reach standard output.
+        self._buffer.detach()
+        if self._gzip_file is not None:
+            # Writes the gzip trailer; doesn't close the stream underneath.
+            self._gzip_file.close()
+        if self._owns_binary:
+            self._binary.close()
+        else:
+            self._binary.flush()
+
+
+class JsonlBadgeWriter(BadgeWriter):
+    def write_section(self, person_type, header):
+        pass
+
+    def write_badge(self, person, badge_text):
+        record = {
+            "id": person[0],
+            "name": person[1],
+            "title": person[2],
+            "type": person[3],
+            "badge": badge_text,
+        }
+        self.stream.write(json.dumps(record))
+        self.stream.write("\n")
+
+
+class CsvBadgeWriter(BadgeWriter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._csv = csv.writer(self.stream, lineterminator="\n")
+        if not self.resuming:
+            self._csv.writerow(["id", "name", "title", "type", "badge"])
+
+    def write_section(self, person_type, header):
+        pass
+
+    def write_badge(self, person, badge_text):
+        self._csv.writerow([person[0], person[1], person[2], person[3], badge_text])
+
+
+WRITERS = {"text": BadgeWriter, "jsonl": JsonlBadgeWriter, "csv": CsvBadgeWriter}
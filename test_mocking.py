@@ -3,10 +3,31 @@ Original Author: edc@mindthump.org
 """
 
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+import asyncio
+import contextlib
+import csv
+import gzip
+import io
+import json
 import logging
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from people.student import Student  # importing a specific class
 from people import people_data, volunteer, employee, utils
+from people.async_people_data import AsyncPeopleData
+from people.loader import load_people
+from people.person import Person, PersonBatch
+from people.latency import LatencyModel
+from people.dataloader import AsyncPersonLoader
+from people.backends import ENGINES
+from people.cache import QueryCache
+from people.metrics import Metrics
+from people.server import BadgeServer
+from people.client import BadgeClient
+from badges import BadgeApp
 
 # Initialize the data source. We only need to do this because
 # we show a few examples of "real" calls for contrast.
@@ -184,3 +205,830 @@ def test_class_patch(mock_datasource_class):
     # NOTE: FIRE IN THE HOLE
     employee_name = employee.Employee(222).get_badge_text()
     assert employee_name == "#222 - Bob (Hacker)"
+
+
+# ---------------- Patch out the "cost" to count round trips
+@patch("people.people_data.time.sleep")
+def test_bulk_lookup(mock_sleep):
+    """
+    Patching `time.sleep` removes the simulated cost, and because every
+    trip to the database sleeps exactly once, the mock's `call_count` tells
+    us how many round trips were made.
+    """
+    # Duplicates are fetched once, unknown IDs are left out.
+    rows = people_data.PeopleData().get_people_by_ids([4, 2, 4, 99])
+    assert [row[0] for row in rows] == [4, 2]
+    assert mock_sleep.call_count == 1
+
+    # Rendering from the rows we already have needs no more lookups.
+    student_badge = Student.get_badge_text_from_row(rows[1])
+    assert student_badge == "HI! My name is Brenda (Senior at Cal)"
+    volunteer_badge = volunteer.Volunteer.get_badge_text_from_row(rows[0])
+    assert volunteer_badge == "** Darla (Intern) **"
+    employee_row = (16, "Bob", "Hacker", "EX-EMPLOYEE")
+    employee_badge = employee.Employee.get_badge_text_from_row(employee_row)
+    assert employee_badge == "#16 - Bob (Hacker)"
+    assert mock_sleep.call_count == 1
+
+
+# ---------------- Count round trips through the cache
+@patch("people.people_data.time.sleep")
+def test_query_cache(mock_sleep):
+    """
+    With the cache switched on, only the first lookup of a person pays for
+    a round trip; the sleep mock shows exactly when the database was used.
+    """
+    cache = people_data.PeopleData.enable_cache(max_size=2, ttl=60)
+    try:
+        # Name and title of the same student: one trip, then a hit.
+        assert Student(2).get_badge_text() == "HI! My name is Brenda (Senior at Cal)"
+        assert mock_sleep.call_count == 1
+        assert cache.stats()["hits"] == 1
+
+        # After invalidating, the next lookup goes to the database again.
+        assert cache.invalidate(2) == 1
+        people_data.PeopleData().get_name_by_id(2)
+        assert mock_sleep.call_count == 2
+
+        # Only two entries fit, so a third lookup evicts the oldest.
+        people_data.PeopleData().get_name_by_id(1)
+        people_data.PeopleData().get_name_by_id(3)
+        assert cache.stats()["evictions"] == 1
+
+        cache.clear()
+        assert len(cache) == 0
+
+        # Adding or removing anybody drops cached sections, which they may
+        # belong in, as well as lookups of them.
+        people_class = people_data.PeopleData
+        assert len(people_class().get_people_by_type("STUDENT")) == 2
+        people_class.insert_people([(30, "Quinn", "Junior at Davis", "STUDENT")])
+        assert len(people_class().get_people_by_type("STUDENT")) == 3
+        people_class.delete_people([30])
+        assert len(people_class().get_people_by_type("STUDENT")) == 2
+    finally:
+        people_data.PeopleData.disable_cache()
+
+
+# ---------------- Assert a mock was NOT called
+@patch("people.people_data.time.sleep")
+def test_unknown_id_fails_fast(mock_sleep):
+    """
+    `assert_not_called()` is the other half of `call_count`: IDs that are
+    not in the database are rejected before any round trip is made.
+    """
+    with pytest.raises(people_data.sqlite3.DataError):
+        people_data.PeopleData().get_person_by_id(16)
+    mock_sleep.assert_not_called()
+
+    # Once a person is inserted the same lookup goes through.
+    people_data.PeopleData.insert_people([(16, "Bob", "Hacker", "EX-EMPLOYEE")])
+    try:
+        assert employee.Employee(16).get_badge_text() == "#16 - Bob (Hacker)"
+        mock_sleep.assert_called_once()
+    finally:
+        people_data.PeopleData.delete_people([16])
+
+    # An ID typed in as a string isn't filtered out; sqlite finds it.
+    assert people_data.PeopleData().get_name_by_id("6") == "Francis"
+
+
+# ---------------- Patch a coroutine with AsyncMock
+@patch("people.async_people_data.asyncio.sleep", new_callable=AsyncMock)
+def test_async_data_source(mock_async_sleep):
+    """
+    A coroutine has to be replaced by something that can be awaited.
+    `AsyncMock` is a MagicMock whose calls return awaitables, and it keeps
+    count of how many times it was awaited.
+    """
+
+    async def fetch():
+        async_data = AsyncPeopleData(max_concurrency=2)
+        return await asyncio.gather(
+            async_data.get_name_by_id(2),
+            async_data.get_title_by_id(4),
+            async_data.get_people_by_type("VOLUNTEER"),
+        )
+
+    name, title, volunteers = asyncio.run(fetch())
+    assert (name, title) == ("Brenda", "Intern")
+    assert [row[1] for row in volunteers] == ["Darla", "Harvey"]
+    assert mock_async_sleep.await_count == 3
+
+
+# ---------------- Patch several class attributes at once
+def test_per_thread_connections():
+    """
+    `patch.multiple()` swaps several attributes for the length of the
+    `with` block and puts the originals back afterwards, which makes it
+    handy for class-level configuration. Here each thread gets its own
+    connection to a fresh shared-cache database, without disturbing the one
+    the other tests use.
+    """
+    with patch.multiple(
+        people_data.PeopleData,
+        database="file:test_threads?mode=memory&cache=shared",
+        per_thread_connections=True,
+        _thread_local=threading.local(),
+        latency=LatencyModel(),
+        known_ids=None,
+    ):
+        # The main thread's connection also keeps the database alive.
+        main_connection = people_data.PeopleData.connection
+        people_data.PeopleData.initialize_data()
+
+        def names_and_connection(person_type):
+            rows = people_data.PeopleData().get_people_by_type(person_type)
+            return [row[1] for row in rows], id(people_data.PeopleData.connection)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            results = list(pool.map(names_and_connection, ["STUDENT", "VOLUNTEER"]))
+
+        assert [names for names, _ in results] == [
+            ["Brenda", "George"],
+            ["Darla", "Harvey"],
+        ]
+        assert id(main_connection) not in {connection for _, connection in results}
+        main_connection.close()
+
+
+# ---------------- Mocks can't see inside a generator until it runs
+@patch("people.people_data.time.sleep")
+def test_streaming_rows(mock_sleep):
+    """
+    Calling a generator function runs none of its body, so the "cost" (our
+    mocked sleep) isn't paid until the first row is asked for.
+    """
+    rows = people_data.PeopleData().iter_all_people(batch_size=3)
+    mock_sleep.assert_not_called()
+    assert next(rows)[1] == "Alice"
+    mock_sleep.assert_called_once()
+    assert [row[0] for row in rows] == [2, 3, 4, 5, 6, 7, 8]
+
+    # The empty-result error also waits for the first row.
+    no_alumni = people_data.PeopleData().iter_people_by_type("ALUMNUS")
+    with pytest.raises(people_data.sqlite3.DataError):
+        next(no_alumni)
+
+
+@patch("people.people_data.time.sleep")
+def test_grouped_roster(mock_sleep):
+    """
+    One round trip for the whole roster, grouped in the order asked for,
+    and nothing to sort before the first row. `autospec=True` plus a
+    `side_effect` of the real method lets the call through and keeps its
+    arguments (`self` included) for a look afterwards.
+    """
+    people_class = people_data.PeopleData
+    with patch.object(
+        people_class,
+        "_iter_query",
+        autospec=True,
+        side_effect=people_class._iter_query,
+    ) as mock_iter_query:
+        rows = people_class().iter_people_grouped_by_type(
+            ["VOLUNTEER", "STUDENT", "VOLUNTEER"]
+        )
+        assert [row[1] for row in rows] == ["Darla", "Harvey", "Brenda", "George"]
+    mock_sleep.assert_called_once()
+    _self, query_string, parameters = mock_iter_query.call_args[0][:3]
+    plan = people_class.explain_query_plan(query_string, parameters)
+    assert not any("TEMP B-TREE" in step for step in plan)
+
+
+# ---------------- Patch in a throwaway database
+def test_schema_migration():
+    """
+    `patch.object()` replaces one attribute of an object we already hold.
+    Swapping in a fresh in-memory connection lets us build an old,
+    unversioned table and migrate it without touching the shared database.
+    """
+    scratch_connection = people_data.sqlite3.connect(":memory:")
+    with patch.object(people_data.PeopleData, "_shared_connection", scratch_connection):
+        connection = people_data.PeopleData.connection
+        connection.execute(
+            "CREATE TABLE people(id INT, name TEXT, title TEXT, type TEXT)"
+        )
+        connection.execute(
+            "INSERT INTO people VALUES (9, 'Ivy', 'Mentor', 'VOLUNTEER')"
+        )
+
+        people_data.PeopleData.migrate()
+
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        assert version == people_data.SCHEMA_VERSION
+        assert connection.execute("SELECT * FROM people").fetchall() == [
+            (9, "Ivy", "Mentor", "VOLUNTEER")
+        ]
+        plans = people_data.PeopleData.explain_queries()
+        assert "PRIMARY KEY" in plans[people_data.PERSON_BY_ID_QUERY][0]
+        assert "INDEX people_type" in plans[people_data.PEOPLE_BY_TYPE_QUERY][0]
+
+        # From version 2, only the update trigger is replaced.
+        connection.execute("PRAGMA user_version = 2")
+        people_data.PeopleData.migrate()
+        connection.execute("UPDATE people SET id = 19 WHERE id = 9")
+        changes = connection.execute(
+            "SELECT id, deleted FROM people_changes ORDER BY change"
+        ).fetchall()
+        assert changes[-2:] == [(9, 1), (19, 0)]
+
+    # A row that can't be copied rolls the whole upgrade back.
+    scratch_connection = people_data.sqlite3.connect(":memory:")
+    with patch.object(people_data.PeopleData, "_shared_connection", scratch_connection):
+        scratch_connection.execute(
+            "CREATE TABLE people(id INT, name TEXT, title TEXT, type TEXT)"
+        )
+        scratch_connection.execute(
+            "INSERT INTO people VALUES ('x9', 'Ivy', 'Mentor', 'VOLUNTEER')"
+        )
+        scratch_connection.commit()
+        with pytest.raises(people_data.sqlite3.IntegrityError):
+            people_data.PeopleData.migrate()
+        tables = scratch_connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchall()
+        assert tables == [("people",)]
+        assert scratch_connection.execute("SELECT id FROM people").fetchall() == [
+            ("x9",)
+        ]
+
+
+def test_bulk_loader(tmp_path):
+    """
+    Load a CSV and a JSONL file into a scratch database (`tmp_path` is a
+    pytest fixture: a fresh directory for each test).
+    """
+    csv_path = tmp_path / "people.csv"
+    csv_path.write_text("id,name,title,type\n9,Ivy,Mentor,VOLUNTEER\n")
+    jsonl_path = tmp_path / "people.jsonl"
+    jsonl_path.write_text(
+        '{"id": 10, "name": "Jo", "title": "QA", "type": "EMPLOYEE"}\n'
+    )
+
+    scratch_connection = people_data.sqlite3.connect(":memory:")
+    with patch.multiple(
+        people_data.PeopleData,
+        _shared_connection=scratch_connection,
+        known_ids=set(),
+    ):
+        assert load_people(csv_path, chunk_size=1)["rows"] == 1
+        assert load_people(jsonl_path)["rows"] == 1
+        assert people_data.PeopleData.known_ids == {9, 10}
+        rows = scratch_connection.execute("SELECT * FROM people").fetchall()
+        assert rows == [(9, "Ivy", "Mentor", "VOLUNTEER"), (10, "Jo", "QA", "EMPLOYEE")]
+        plan = people_data.PeopleData.explain_query_plan(
+            people_data.PEOPLE_BY_TYPE_QUERY, ["EMPLOYEE"]
+        )
+        assert "INDEX people_type" in plan[0]
+
+        # A bad record stops the load, but the chunks before it are in the
+        # database and can be looked up.
+        bad_path = tmp_path / "bad.csv"
+        bad_path.write_text("id,name,title,type\n20,Zed,Coach,VOLUNTEER\nx,?,?,?\n")
+        with pytest.raises(ValueError):
+            load_people(bad_path, chunk_size=1)
+        assert 20 in people_data.PeopleData.known_ids
+        with patch("people.people_data.time.sleep"):
+            assert people_data.PeopleData().get_name_by_id(20) == "Zed"
+
+
+@patch("people.people_data.time.sleep")
+def test_person_records(mock_sleep):
+    """
+    Rows are Person records: named fields, but still equal to plain tuples,
+    which is why the tuple return values in the tests above keep working.
+    """
+    darla = people_data.PeopleData().get_person_by_id(4)
+    assert (darla.name, darla.title) == ("Darla", "Intern")
+    assert darla == (4, "Darla", "Intern", "VOLUNTEER")
+
+    batch = PersonBatch.from_rows(people_data.PeopleData().iter_all_people())
+    assert len(batch) == 8
+    assert batch[3] == darla
+    assert [person.name for person in batch][:2] == ["Alice", "Brenda"]
+
+    # Only strings are interned; a NULL title comes back as None.
+    zed = (20, "Zed", None, "VOLUNTEER")
+    assert Person.row_factory(None, zed) == zed
+    assert PersonBatch.from_rows([zed])[0] == zed
+
+
+@patch("people.people_data.time.sleep")
+def test_latency_model(mock_sleep):
+    """
+    A per-row cost is charged once the rows are in, as a second sleep.
+    `call_args_list` shows every call the mock received, in order.
+    """
+    latency = LatencyModel.from_spec("fixed=0.5,per_row=0.25")
+    with patch.object(people_data.PeopleData, "latency", latency):
+        people_data.PeopleData().get_people_by_type("STUDENT")
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [0.5, 0.5]
+
+    jittery = LatencyModel.from_spec("jitter=uniform:0.1,seed=1")
+    assert all(0 <= jittery.query_cost() <= 0.1 for _ in range(100))
+    assert LatencyModel.from_spec("none").query_cost() == 0
+    assert LatencyModel.from_spec("2").query_cost() == 2
+
+
+@patch("people.people_data.time.sleep")
+def test_query_metrics(mock_sleep):
+    """
+    A MagicMock makes a handy hook: it accepts any call and remembers them.
+    """
+    metrics = people_data.PeopleData.enable_metrics()
+    mock_hook = MagicMock()
+    metrics.add_hook(mock_hook)
+    # A clock that only moves when the test moves it.
+    clock = [0.0]
+    try:
+        Student(2).get_badge_text()
+        people_data.PeopleData().get_people_by_ids([1, 2, 3])
+        with patch("people.people_data.time.perf_counter", lambda: clock[0]):
+            for _person in people_data.PeopleData().iter_all_people(batch_size=3):
+                clock[0] += 10  # a slow consumer
+    finally:
+        people_data.PeopleData.disable_metrics()
+
+    callers = [event["caller"] for (event,), _ in mock_hook.call_args_list]
+    assert callers == [
+        "get_name_by_id",
+        "get_title_by_id",
+        "get_people_by_ids",
+        "iter_all_people",
+    ]
+    by_caller = {caller: timings for (_, caller), timings in metrics.queries.items()}
+    assert by_caller["get_people_by_ids"].rows == 3
+    # The query is timed, not what the consumer did between rows.
+    assert by_caller["iter_all_people"].rows == 8
+    assert by_caller["iter_all_people"].seconds == 0
+    assert "IN (?, ...)" in metrics.summary()
+
+    # Threads recording at once don't lose each other's counts.
+    shared = Metrics()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for _ in range(8):
+            pool.submit(
+                lambda: [shared.record_render("Student", 0.001) for _ in range(500)]
+            )
+    assert shared.renders["Student"].calls == 4000
+
+
+def test_queued_logging(tmp_path):
+    """
+    With `queued=True` the caller only enqueues the record; formatting and
+    file writes happen on the listener thread. Only the people package's
+    own records are left unformatted until then.
+    """
+    utils.initialize_logging(
+        logging_directory=str(tmp_path), console_log_level=logging.ERROR, queued=True
+    )
+    try:
+        # MagicMock lets us supply our own `__str__`, which records the
+        # thread that formatted the message.
+        formatting_threads = set()
+
+        def fake_str(_self):
+            formatting_threads.add(threading.current_thread())
+            return "formatted later"
+
+        mock_argument = MagicMock()
+        mock_argument.__str__ = fake_str
+        logging.getLogger("people.test").debug("Lazy: %s", mock_argument)
+        # Somebody else's arguments could change after the call, so their
+        # message is formatted straight away.
+        roster = ["Alice"]
+        logging.getLogger("elsewhere").debug("Roster: %s", roster)
+        roster.append("Bob")
+        try:
+            raise ValueError("bad row")
+        except ValueError:
+            logging.getLogger("people.test").exception("Failed")
+        utils.stop_queued_logging()
+        assert formatting_threads
+        assert threading.current_thread() not in formatting_threads
+        log_text = (tmp_path / "common.log").read_text()
+        assert "Lazy: formatted later" in log_text
+        assert "Roster: ['Alice']" in log_text
+        assert "ValueError: bad row" in log_text
+    finally:
+        # Back to the plain set-up the rest of the tests use.
+        utils.initialize_logging(console_log_level=logging.ERROR)
+
+
+@patch("people.people_data.time.sleep")
+def test_request_coalescing(mock_sleep):
+    """
+    With the loader on, the unchanged badge classes share round trips:
+    concurrent lookups are batched, and a student's name and title come
+    from the same row.
+    """
+    # A batch goes out as soon as it holds four IDs, so however the threads
+    # are scheduled the four employees share one; the long window only
+    # matters if one of them never turns up.
+    loader = people_data.PeopleData.enable_loader(window=10, max_batch_size=4)
+    try:
+        def badge_text(_id):
+            return employee.Employee(_id).get_badge_text()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            badges = list(pool.map(badge_text, [1, 3, 5, 6]))
+        assert badges[1] == "#3 - Charlie (Manager)"
+        assert loader.batches == 1
+        loader.window = 0
+        assert Student(2).get_badge_text() == "HI! My name is Brenda (Senior at Cal)"
+        assert loader.batches == mock_sleep.call_count == 2
+        # Rows it remembers are dropped with everything else after a reload.
+        people_data.PeopleData.forget_cached_rows()
+        assert len(loader._rows) == 0
+    finally:
+        people_data.PeopleData.disable_loader()
+
+    async def fetch_names():
+        async_loader = AsyncPersonLoader(AsyncPeopleData())
+        names = await asyncio.gather(
+            *(async_loader.get_name_by_id(_id) for _id in [7, 8, 7])
+        )
+        return names, async_loader.batches
+
+    with patch("people.async_people_data.asyncio.sleep", new_callable=AsyncMock):
+        assert asyncio.run(fetch_names()) == (["George", "Harvey", "George"], 1)
+
+
+def test_sharded_badges(capsys):
+    """
+    Worker processes each render one ID range, and the merged output is
+    the same as a plain run. (BadgeApp sets the class-wide latency; the
+    `patch.object` block puts the original back afterwards.)
+    """
+    assert people_data.PeopleData.shard_id_ranges(3) == [(1, 2), (3, 5), (6, 8)]
+    with patch.object(people_data.PeopleData, "latency"):
+        BadgeApp(["--latency", "none"]).run()
+        expected_output = capsys.readouterr().out
+        BadgeApp(["--latency", "none", "--processes", "3"]).run()
+        assert capsys.readouterr().out == expected_output
+    assert "#6 - Francis (QA)" in expected_output
+
+
+def test_database_file_kept(tmp_path):
+    """
+    A --database file is only seeded with the demo people while it's
+    empty; later runs leave its rows alone. `patch.multiple()` puts back
+    the connection settings that `--database` changes class-wide.
+    """
+    database_path = tmp_path / "roster.db"
+    arguments = ["--latency", "none", "--database", str(database_path)]
+    with patch.multiple(
+        people_data.PeopleData,
+        database=people_data.PeopleData.database,
+        per_thread_connections=False,
+        _shared_connection=people_data.PeopleData._shared_connection,
+        _thread_local=threading.local(),
+        latency=LatencyModel(),
+        known_ids=None,
+    ):
+        BadgeApp(arguments)
+        with people_data.sqlite3.connect(database_path) as connection:
+            connection.execute("UPDATE people SET title = 'CEO' WHERE id = 6")
+        BadgeApp(arguments)
+        assert people_data.PeopleData().get_title_by_id(6) == "CEO"
+
+
+@pytest.mark.parametrize(
+    "mode",
+    [[], ["--async"], ["--workers", "2"], ["--processes", "2"], ["--page-size", "3"]],
+)
+def test_empty_section(mode, capsys, tmp_path):
+    """
+    `parametrize` runs the test once per run mode. A section with nobody
+    in it prints just its header in every one of them.
+    """
+    database_path = tmp_path / "roster.db"
+    with people_data.sqlite3.connect(database_path) as connection:
+        connection.execute(
+            "CREATE TABLE people(id INT, name TEXT, title TEXT, type TEXT)"
+        )
+        connection.execute("INSERT INTO people VALUES (1, 'Al', 'Dev', 'EMPLOYEE')")
+    arguments = ["--latency", "none", "--database", str(database_path)]
+    with patch.multiple(
+        people_data.PeopleData,
+        database=people_data.PeopleData.database,
+        per_thread_connections=False,
+        _shared_connection=people_data.PeopleData._shared_connection,
+        _thread_local=threading.local(),
+        latency=LatencyModel(),
+        known_ids=None,
+    ):
+        BadgeApp(arguments + ["--types", "volunteer"] + mode).run()
+        assert capsys.readouterr().out == "------- VOLUNTEERS -------\n"
+        BadgeApp(arguments + ["--types", "employee,volunteer"] + mode).run()
+        assert capsys.readouterr().out.endswith("(Dev)\n------- VOLUNTEERS -------\n")
+
+
+@pytest.mark.parametrize(
+    "arguments",
+    [
+        ["--async", "--concurrency", "0"],
+        ["--workers", "0"],
+        ["--processes", "-2"],
+        ["--page-size", "-1"],
+    ],
+)
+def test_counts_must_be_positive(arguments, capsys):
+    """
+    argparse rejects the value before anything runs (it would otherwise
+    hang, or page without a limit).
+    """
+    with pytest.raises(SystemExit):
+        BadgeApp(["--latency", "none"] + arguments)
+    assert "must be at least 1" in capsys.readouterr().err
+    if "--async" in arguments:
+        # The same check for code that builds its own AsyncPeopleData.
+        with pytest.raises(ValueError):
+            AsyncPeopleData(max_concurrency=0)
+
+
+@pytest.mark.parametrize(
+    "arguments",
+    [
+        ["--async", "--workers", "4"],
+        ["--incremental", "badges.json", "--page-size", "10"],
+        ["--processes", "2", "--async"],
+        ["--serve", "0", "--output", "badges.txt"],
+    ],
+)
+def test_conflicting_modes(arguments, capsys):
+    """
+    Only one way of running at a time, rather than one flag silently
+    winning over the other.
+    """
+    with pytest.raises(SystemExit):
+        BadgeApp(["--latency", "none"] + arguments)
+    assert "error:" in capsys.readouterr().err
+
+
+def test_badge_formats(capsys, tmp_path):
+    """
+    The same badges as JSON lines on standard output (even a redirected,
+    text-only one), and as gzipped CSV.
+    """
+    with patch.object(people_data.PeopleData, "latency"):
+        jsonl_arguments = ["--format", "jsonl", "--types", "volunteer"]
+        BadgeApp(["--latency", "none"] + jsonl_arguments).run()
+        output_path = tmp_path / "badges.csv.gz"
+        csv_arguments = ["--format", "csv", "--output", str(output_path)]
+        BadgeApp(["--latency", "none"] + csv_arguments).run()
+        # Standard output swapped for a text-only stream has no `.buffer`.
+        text_only = io.StringIO()
+        with contextlib.redirect_stdout(text_only):
+            BadgeApp(["--latency", "none"] + jsonl_arguments).run()
+
+    assert json.loads(text_only.getvalue().splitlines()[0])["id"] == 4
+    first_volunteer = json.loads(capsys.readouterr().out.splitlines()[0])
+    assert first_volunteer["badge"] == "** Darla (Intern) **"
+    with gzip.open(output_path, "rt") as csv_file:
+        rows = list(csv.reader(csv_file))
+    assert rows[0] == ["id", "name", "title", "type", "badge"]
+    assert rows[1][:4] == ["2", "Brenda", "Senior at Cal", "STUDENT"]
+    assert rows[1][4] == "HI! My name is Brenda (Senior at Cal)"
+
+
+def test_incremental_badges(capsys, caplog, tmp_path):
+    """
+    Later runs re-render only the people whose rows changed, and drop the
+    ones who were deleted. `caplog` is a pytest fixture that collects log
+    records, so the test can read the counts the app reports.
+    """
+    cache_path = tmp_path / "badges.json"
+    arguments = ["--latency", "none", "--incremental", str(cache_path)]
+    scratch_connection = people_data.sqlite3.connect(":memory:")
+    with patch.multiple(
+        people_data.PeopleData,
+        _shared_connection=scratch_connection,
+        latency=LatencyModel(),
+        known_ids=set(),
+    ), caplog.at_level(logging.INFO):
+        BadgeApp(arguments).run()
+        people_data.PeopleData.insert_people(
+            [(9, "Ivy", "Mentor", "VOLUNTEER"), (10, "Jo", "Helper", "VOLUNTEER")]
+        )
+        BadgeApp(arguments).run()
+        second_output = capsys.readouterr().out
+        scratch_connection.execute("UPDATE people SET title = 'Coach' WHERE id = 9")
+        people_data.PeopleData.delete_people([10])
+        BadgeApp(arguments).run()
+        third_output = capsys.readouterr().out
+        # A new ID is a new badge, and the old one has to go.
+        scratch_connection.execute("UPDATE people SET id = 41 WHERE id = 9")
+        BadgeApp(arguments).run()
+        fourth_output = capsys.readouterr().out
+
+    assert caplog.messages[-4:] == [
+        "0 badges reused, 8 re-rendered, 0 removed.",
+        "8 badges reused, 2 re-rendered, 0 removed.",
+        "8 badges reused, 1 re-rendered, 1 removed.",
+        "8 badges reused, 1 re-rendered, 1 removed.",
+    ]
+    assert second_output.endswith("** Ivy (Mentor) **\n** Jo (Helper) **\n")
+    assert third_output.endswith("(Charlie's Friend) **\n** Ivy (Coach) **\n")
+    assert fourth_output.count("Ivy") == 1
+    assert fourth_output.endswith("(Charlie's Friend) **\n** Ivy (Coach) **\n")
+
+
+def test_startup_snapshot(tmp_path, caplog):
+    """
+    The first run builds the database and saves a snapshot; the next ones
+    restore it instead, and only those are held to the startup budget.
+    `wraps=` makes a mock that passes every call on to the real method, so
+    it still works but the calls can be counted.
+    """
+    snapshot_path = tmp_path / "people.db"
+    arguments = ["--latency", "none", "--snapshot", str(snapshot_path)]
+    people_class = people_data.PeopleData
+    with patch.multiple(
+        people_class,
+        database=people_class.database,
+        per_thread_connections=people_class.per_thread_connections,
+        _shared_connection=people_data.sqlite3.connect(":memory:"),
+        _thread_local=people_class._thread_local,
+        mmap_size=0,
+        known_ids=set(),
+    ), patch.object(
+        people_class, "initialize_data", wraps=people_class.initialize_data
+    ) as mock_initialize, patch("badges.STARTUP_BUDGET", 0):
+        BadgeApp(arguments)
+        assert snapshot_path.exists()
+        assert "budget" not in caplog.text
+        BadgeApp(arguments)
+        assert mock_initialize.call_count == 1
+        assert "over the 0.0 ms budget" in caplog.text
+        assert people_class().get_name_by_id(6) == "Francis"
+
+        # Memory-mapping is for the read-only snapshot, not whatever
+        # database comes next.
+        assert people_class.restore_snapshot(snapshot_path, read_only=True)
+        assert people_class.connection.execute("PRAGMA mmap_size").fetchone()[0]
+        people_class.configure_connections(":memory:", per_thread=False)
+        assert people_class.mmap_size == 0
+
+        # Something that isn't a snapshot is an error, not a file to replace.
+        notes_path = tmp_path / "notes.txt"
+        notes_path.write_text("my notes\n")
+        with pytest.raises(SystemExit):
+            BadgeApp(["--latency", "none", "--snapshot", str(notes_path)])
+        assert notes_path.read_text() == "my notes\n"
+
+    # The badge classes aren't imported until a BadgeApp asks for them.
+    # (This test module already imported them, so check in a fresh process.)
+    check = "import badges, sys; print('people.student' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", check], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_resumable_paging(tmp_path):
+    """
+    Interrupt a paged run part way and resume it; the output comes out the
+    same as one uninterrupted run. `autospec=True` makes the patched method
+    receive `self` like the real one, so the `side_effect` can call the
+    original for every page but the one that "crashes".
+    """
+    output_path = tmp_path / "badges.txt"
+    progress_path = tmp_path / "progress.json"
+    arguments = ["--latency", "none", "--page-size", "1", "--output", str(output_path)]
+    people_class = people_data.PeopleData
+    real_page = people_class.get_people_by_type_page
+    pages = []
+
+    def crash_on_fifth_page(self, *args, **kwargs):
+        pages.append(args)
+        if len(pages) == 5:
+            raise KeyboardInterrupt
+        return real_page(self, *args, **kwargs)
+
+    with patch.object(people_class, "latency"):
+        BadgeApp(arguments).run()
+        expected_output = output_path.read_text()
+        resume_arguments = arguments + ["--resume", str(progress_path)]
+        with patch.object(
+            people_class,
+            "get_people_by_type_page",
+            autospec=True,
+            side_effect=crash_on_fifth_page,
+        ), pytest.raises(KeyboardInterrupt):
+            BadgeApp(resume_arguments).run()
+        assert json.loads(progress_path.read_text())["after_id"] == 1
+        BadgeApp(resume_arguments).run()
+
+    assert output_path.read_text() == expected_output
+    assert not progress_path.exists()
+
+
+@patch("people.people_data.time.sleep")
+def test_badge_server(mock_sleep):
+    """
+    Serve badges from a thread and ask for them with the client. The sleep
+    mock is module-wide, so it counts the server threads' round trips too:
+    asking for the same badge again is answered from the warm cache.
+    """
+    with patch.multiple(
+        people_data.PeopleData,
+        # The server's threads share it, as they share the real one.
+        _shared_connection=people_data.sqlite3.connect(
+            ":memory:", check_same_thread=False
+        ),
+        known_ids=None,
+        backend=None,
+        cache=QueryCache(),
+    ):
+        people_data.PeopleData.initialize_data()
+        badge_classes = {"EMPLOYEE": employee.Employee, "STUDENT": Student}
+        server = BadgeServer(("127.0.0.1", 0), badge_classes)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = BadgeClient(server.server_address[1])
+        try:
+            assert client.badge(6) == "#6 - Francis (QA)"
+            assert client.badge(6) == "#6 - Francis (QA)"
+            assert mock_sleep.call_count == 1
+            assert client.badges([7, 4, 99]) == {
+                7: "HI! My name is George (Freshman at Stanford)"
+            }
+            assert [_id for _id, _ in client.section("employee")] == [1, 3, 5, 6]
+            # Darla is a volunteer, and volunteers aren't being served.
+            with pytest.raises(LookupError):
+                client.badge(4)
+            with pytest.raises(LookupError):
+                client.section("volunteer")
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+
+# ---------------- Run the same tests against every backend
+@pytest.fixture(params=["sqlite"] + sorted(ENGINES))
+def any_backend(request):
+    """
+    A parametrized fixture: pytest runs each test that asks for it once per
+    value in `params`, here once per storage engine, so each engine has to
+    give exactly the answers sqlite gives. The fixture yields a PeopleData
+    on a scratch database, answering from `request.param`.
+    """
+    with patch.multiple(
+        people_data.PeopleData,
+        _shared_connection=people_data.sqlite3.connect(":memory:"),
+        latency=LatencyModel(),
+        known_ids=None,
+        backend=None,
+    ):
+        people_data.PeopleData.initialize_data()
+        people_data.PeopleData.use_backend(request.param)
+        yield people_data.PeopleData()
+
+
+def test_backend_lookups(any_backend):
+    assert any_backend.get_person_by_id(6) == (6, "Francis", "QA", "EMPLOYEE")
+    assert any_backend.get_title_by_id(7) == "Freshman at Stanford"
+    assert [row.id for row in any_backend.get_people_by_ids([8, 99, 2, 8])] == [8, 2]
+    assert [row.id for row in any_backend.get_people_by_type("STUDENT")] == [2, 7]
+    assert [row.id for row in any_backend.get_all_people()] == list(range(1, 9))
+    grouped = any_backend.iter_people_grouped_by_type(["VOLUNTEER", "STUDENT"])
+    assert [row.id for row in grouped] == [4, 8, 2, 7]
+    in_range = any_backend.iter_people_grouped_by_type(
+        ["VOLUNTEER", "STUDENT"], first_id=3, last_id=7
+    )
+    assert [row.id for row in in_range] == [4, 7]
+
+
+def test_backend_errors(any_backend):
+    data_error = people_data.sqlite3.DataError
+    with pytest.raises(data_error):
+        any_backend.get_name_by_id(99)
+    with pytest.raises(data_error):
+        any_backend.get_people_by_ids([98, 99])
+    with pytest.raises(data_error):
+        any_backend.get_people_by_type("ALIEN")
+    # Streaming queries only raise once they are started.
+    rows = any_backend.iter_people_by_type("ALIEN")
+    with pytest.raises(data_error):
+        next(rows)
+
+
+def test_backend_writes(any_backend):
+    people_data.PeopleData.insert_people([(9, "Ivy", "Mentor", "VOLUNTEER")])
+    people_data.PeopleData.delete_people([4])
+    assert any_backend.get_name_by_id(9) == "Ivy"
+    assert [row.id for row in any_backend.get_people_by_type("VOLUNTEER")] == [8, 9]
+    with pytest.raises(people_data.sqlite3.DataError):
+        any_backend.get_person_by_id(4)
+
+
+def test_backend_paging(any_backend):
+    people, token = any_backend.get_all_people_page(page_size=3)
+    assert [row.id for row in people] == [1, 2, 3] and token == 3
+    people, token = any_backend.get_all_people_page(after_id=6, page_size=3)
+    assert [row.id for row in people] == [7, 8] and token is None
+    people, token = any_backend.get_people_by_type_page("EMPLOYEE", 1, 2)
+    assert [row.id for row in people] == [3, 5] and token == 5
+    assert any_backend.get_people_by_type_page("EMPLOYEE", 6, 2) == ([], None)